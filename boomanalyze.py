@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Compute difficulty metrics of generated levels in bulk.
+#
+# boomanalyze.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Levels are either generated on the fly (-g N, seeded) or read from pack
+# files, and analyzed by a pool of worker processes. The result is a table
+# with one row per level, written as CSV or as columnar JSON (one
+# homogeneous array per metric, ready to be loaded into a dataframe or
+# written out as Parquet).
+
+from collections import deque
+from multiprocessing import Pool
+from optparse import OptionParser
+from sys import stdout
+import csv
+import json
+import random
+
+import boomlevelgen
+from boomlevelgen import BOOMLevel, LevelPack, tiles, N_LEVELS, \
+	SYM_NONE, SYM_AXIAL_X, SYM_AXIAL_Y, SYM_CENTRAL
+
+ENEMIES = tiles['enemy']
+
+COLUMNS = [
+	'source', 'level', 'symmetry', 'wallsAlg',
+	'wallDensity', 'breakableRatio', 'fixed', 'breakable', 'coins', 'teleports', 'bosses',
+	'enemies'] + ['enemy' + e for e in ENEMIES] + [
+	'distEnemyMin', 'distEnemyMean', 'distCoinMin', 'distCoinMean', 'unreachable',
+	'regionsBeforeRepair', 'teleportSpread',
+]
+
+# Neighbour lists for each cell of the flattened grid, computed once per
+# grid size.
+_neighbours = {}
+
+def neighbours(width, height):
+	key = (width, height)
+	if key not in _neighbours:
+		neigh = []
+		for y in range(height):
+			for x in range(width):
+				n = []
+				if y > 0: n.append((y - 1) * width + x)
+				if y < height - 1: n.append((y + 1) * width + x)
+				if x > 0: n.append(y * width + x - 1)
+				if x < width - 1: n.append(y * width + x + 1)
+				neigh.append(n)
+		_neighbours[key] = neigh
+	return _neighbours[key]
+
+
+def distances(grid, sources, width, height):
+	'''Multi-source BFS over the non-fixed cells of a grid string. Breakable
+	blocks are walked through, as the player can bomb them.
+	Returns a list of distances (-1 for unreachable cells).'''
+	neigh = neighbours(width, height)
+	fixed = tiles['fixed']
+	dist = [-1] * len(grid)
+	queue = deque()
+	for s in sources:
+		dist[s] = 0
+		queue.append(s)
+	while queue:
+		c = queue.popleft()
+		d = dist[c] + 1
+		for n in neigh[c]:
+			if dist[n] < 0 and grid[n] != fixed:
+				dist[n] = d
+				queue.append(n)
+	return dist
+
+
+def detectSymmetry(grid, width, height):
+	'Returns the symmetry of the walls of a grid string'
+	walls = {tiles['fixed'], tiles['breakable']}
+	rows = [[c in walls for c in grid[y * width:(y + 1) * width]] for y in range(height)]
+	if rows == rows[::-1]:
+		return SYM_AXIAL_X
+	if all(r == r[::-1] for r in rows):
+		return SYM_AXIAL_Y
+	if rows == [r[::-1] for r in reversed(rows)]:
+		return SYM_CENTRAL
+	return SYM_NONE
+
+
+def analyze(grid, width = BOOMLevel.WIDTH, height = BOOMLevel.HEIGHT, **known):
+	'''Computes the metrics of a grid string. `known` may hold values of the
+	columns which can't be derived from the grid alone (e.g. wallsAlg).
+	Returns a dict column -> value.'''
+	if len(grid) != width * height:
+		raise ValueError("grid has {} cells, expected {}".format(len(grid), width * height))
+	count = grid.count
+	nfixed = count(tiles['fixed'])
+	nbreakable = count(tiles['breakable'])
+	enemies = {e: count(e) for e in ENEMIES}
+	nwalls = nfixed + nbreakable
+
+	row = {
+		'source': '',
+		'level': 0,
+		'symmetry': detectSymmetry(grid, width, height),
+		'wallsAlg': '',
+		'wallDensity': nwalls / len(grid),
+		'breakableRatio': nbreakable / nwalls if nwalls else 0.,
+		'fixed': nfixed,
+		'breakable': nbreakable,
+		'coins': count(tiles['coin']),
+		'teleports': count(tiles['teleport']),
+		'bosses': count(tiles['boss']) + count(tiles['lifish_lastboss']),
+		'enemies': sum(enemies.values()),
+		'regionsBeforeRepair': -1,
+	}
+	for e, n in enemies.items():
+		row['enemy' + e] = n
+
+	spawns = [i for i, c in enumerate(grid) if c in (tiles['player1'], tiles['player2'])]
+	dist = distances(grid, spawns, width, height)
+	for name, cells in (('Enemy', ENEMIES), ('Coin', tiles['coin'])):
+		ds = [dist[i] for i, c in enumerate(grid) if c in cells and dist[i] >= 0]
+		row['dist' + name + 'Min'] = min(ds) if ds else -1
+		row['dist' + name + 'Mean'] = sum(ds) / len(ds) if ds else -1.
+	row['unreachable'] = sum(1 for i, c in enumerate(grid) if c != tiles['fixed'] and dist[i] < 0)
+
+	teleports = [(i % width, i // width) for i, c in enumerate(grid) if c == tiles['teleport']]
+	pairs = [abs(ax - bx) + abs(ay - by)
+			for n, (ax, ay) in enumerate(teleports) for bx, by in teleports[n+1:]]
+	row['teleportSpread'] = sum(pairs) / len(pairs) if pairs else 0.
+
+	row.update(known)
+	return row
+
+
+def analyzeGenerated(task):
+	'Worker: generates level `level` with the given seed and analyzes it'
+	level, seed, opts = task
+	random.seed(seed)
+	levelGen = BOOMLevel(level, **opts)
+	grid = levelGen.genGrid()
+	return analyze(grid, source = 'seed:{}'.format(seed), level = level,
+			symmetry = levelGen.symmetry, wallsAlg = levelGen.wallsAlg or '',
+			regionsBeforeRepair = levelGen.regionsBeforeRepair
+				if levelGen.regionsBeforeRepair is not None else -1)
+
+
+def analyzePacked(task):
+	'Worker: analyzes a level read from a pack'
+	grid, source, level = task
+	return analyze(grid, source = source, level = level)
+
+
+def writeCsv(rows, out):
+	writer = csv.DictWriter(out, COLUMNS, lineterminator='\n')
+	writer.writeheader()
+	writer.writerows(rows)
+
+
+def writeColumnar(rows, out):
+	columns = {c: [] for c in COLUMNS}
+	for row in rows:
+		for c in COLUMNS:
+			columns[c].append(row[c])
+	json.dump(columns, out)
+	out.write('\n')
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts] [PACK...]")
+	parser.add_option("-g", "--generate", type="int", default=0, metavar="N", help="Generate and analyze N levels for each level number")
+	parser.add_option("-s", "--seed", type="int", default=0, help="First seed used by --generate")
+	parser.add_option("-L", "--levels", default="1-{}".format(N_LEVELS - 1), help="Level numbers to generate, as a range (default: %default)")
+	parser.add_option("-t", "--faithfulThemes", action="store_true", default=False, help="Use the original themes for the levels")
+	parser.add_option("-e", "--faithfulEnemies", action="store_true", default=False, help="Put enemies according to the original levels")
+	parser.add_option("-d", "--difficulty", default='normal', help="Difficulty (easy, normal)")
+	parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: one per CPU)")
+	parser.add_option("-c", "--columnar", action="store_true", default=False, help="Emit columnar JSON instead of CSV")
+	parser.add_option("-o", "--output", default=None, help="Output file (default: STDOUT)")
+	options, args = parser.parse_args()
+	if not args and not options.generate:
+		parser.error("nothing to analyze: pass some packs or --generate")
+
+	first, _, last = options.levels.partition('-')
+	levelRange = range(int(first), int(last or first) + 1)
+	opts = dict(faithfulThemes = options.faithfulThemes,
+			faithfulEnemies = options.faithfulEnemies,
+			difficulty = options.difficulty)
+	boomlevelgen.quiet = True
+
+	with Pool(options.jobs) as pool:
+		rows = []
+		if options.generate:
+			tasks = [(level, options.seed + n * len(levelRange) + k, opts)
+					for n in range(options.generate) for k, level in enumerate(levelRange)]
+			rows += pool.imap(analyzeGenerated, tasks, chunksize=64)
+		for path in args:
+			with open(path) as f:
+				pack = LevelPack(f.read())
+			tasks = [(pack.grid(num), '{}:{}'.format(path, num), num) for num in sorted(pack.spans)]
+			rows += pool.imap(analyzePacked, tasks, chunksize=64)
+
+	out = open(options.output, 'w', newline='') if options.output else stdout
+	if options.columnar:
+		writeColumnar(rows, out)
+	else:
+		writeCsv(rows, out)
+	if out is not stdout:
+		out.close()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Time and memory scaling benchmark.
+#
+# boombench.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Every configuration (grid size, or batch size) runs in a fresh process,
+# so that its peak RSS is its own. Inside it, the methods of the engine
+# are wrapped to account time (exclusive of nested phases), tracemalloc
+# peak and net allocated blocks to the generation phase they belong to.
+#
+# Scaling is summarized by the exponent of a log-log least squares fit of
+# each measure against the number of cells (or of levels, for batches). A
+# run fails if an exponent exceeds the declared complexity of its phase by
+# more than the tolerance.
+
+from multiprocessing import Pool
+from optparse import OptionParser
+from time import perf_counter
+import json
+import math
+import random
+import resource
+import signal
+import sys
+import tracemalloc
+
+import boomlevelgen
+from boomlevelgen import ENGINES
+
+# method -> phase it's accounted to
+PHASES = {
+	'spawnPlayers': 'spawn',
+	'spawnBosses': 'spawn',
+	'genWallsWithWalkers': 'walls',
+	'genWallsRegularGrid': 'walls',
+	'genWallsRandom': 'walls',
+	'findRegions': 'regions',
+	'openBoundaries': 'regions',
+	'generate': 'populate',
+	'securePlayer': 'populate',
+	'checkUnreachable': 'check',
+	'plistEntry': 'serialize',
+	'lifishEntry': 'serialize',
+}
+
+# declared complexity, as max exponent in the number of cells
+DECLARED_TIME = {
+	'spawn': 1.0,
+	'walls': 1.5,
+	'regions': 2.0,
+	'populate': 1.0,
+	'check': 1.0,
+	'serialize': 1.0,
+}
+DECLARED_MEMORY = 1.0
+# a batch of N levels should cost N times a single level
+DECLARED_BATCH = 1.0
+
+# the original grid, up to the largest square one
+DEFAULT_SIZES = '15x13,31x29,63x61,127x125,255x255'
+DEFAULT_BATCHES = '1,10,100,1000'
+
+
+class Timeout(Exception):
+	pass
+
+
+class PhaseMeter:
+	'Wraps the methods of a class to account their cost to phases'
+	def __init__(self, cls):
+		self.stats = {}
+		# for each running phase: [seconds spent in nested phases, peak traced bytes]
+		self.stack = []
+		for method, phase in PHASES.items():
+			setattr(cls, method, self.wrap(getattr(cls, method), phase))
+
+	def wrap(self, fn, phase):
+		def wrapper(*args, **kwargs):
+			blocks = sys.getallocatedblocks()
+			# resetting the peak loses the one of the enclosing phase so far:
+			# keep it in its frame
+			if self.stack:
+				self.stack[-1][1] = max(self.stack[-1][1], tracemalloc.get_traced_memory()[1])
+			tracemalloc.reset_peak()
+			base = tracemalloc.get_traced_memory()[0]
+			self.stack.append([0., base])
+			start = perf_counter()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				elapsed = perf_counter() - start
+				nested, peak = self.stack.pop()
+				peak = max(peak, tracemalloc.get_traced_memory()[1])
+				if self.stack:
+					self.stack[-1][0] += elapsed
+					self.stack[-1][1] = max(self.stack[-1][1], peak)
+				st = self.stats.setdefault(phase, {'seconds': 0., 'peakBytes': 0, 'blocks': 0, 'calls': 0})
+				st['seconds'] += elapsed - nested
+				st['peakBytes'] = max(st['peakBytes'], peak - base)
+				st['blocks'] += sys.getallocatedblocks() - blocks
+				st['calls'] += 1
+		return wrapper
+
+
+def onAlarm(signum, frame):
+	raise Timeout()
+
+
+def runSize(task):
+	'Worker: generates `levels` levels of the given size, returns the per-phase stats'
+	engine, width, height, levels, seed, timeout = task
+	boomlevelgen.quiet = True
+	cls = ENGINES[engine]
+	boomlevelgen.BOOMLevel.WIDTH = width
+	boomlevelgen.BOOMLevel.HEIGHT = height
+	meter = PhaseMeter(cls)
+	signal.signal(signal.SIGALRM, onAlarm)
+	signal.alarm(timeout)
+	tracemalloc.start()
+	result = {'width': width, 'height': height, 'cells': width * height}
+	try:
+		start = perf_counter()
+		for n in range(levels):
+			random.seed(seed + n)
+			levelGen = cls(level = 5)
+			levelGen.genGridDescString()
+			levelGen.plistEntry()
+			levelGen.lifishEntry()
+		result['seconds'] = (perf_counter() - start) / levels
+	except Timeout:
+		result['timeout'] = True
+	except Exception as e:
+		result['error'] = repr(e)
+	finally:
+		signal.alarm(0)
+		tracemalloc.stop()
+	result['phases'] = {p: {k: v / levels if k != 'peakBytes' else v for k, v in st.items()}
+			for p, st in meter.stats.items()}
+	result['maxRssKb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return result
+
+
+def runBatch(task):
+	'Worker: generates and keeps in memory a batch of levels'
+	engine, levels, seed = task
+	boomlevelgen.quiet = True
+	cls = ENGINES[engine]
+	tracemalloc.start()
+	start = perf_counter()
+	batch = []
+	for n in range(levels):
+		random.seed(seed + n)
+		levelGen = cls(level = 1 + n % (boomlevelgen.N_LEVELS - 1))
+		levelGen.genGrid()
+		batch.append(levelGen)
+	seconds = perf_counter() - start
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return {
+		'levels': levels,
+		'seconds': seconds,
+		'retainedBytes': current,
+		'peakBytes': peak,
+		'maxRssKb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+	}
+
+
+def fitExponent(xs, ys):
+	'Slope of the least squares line through (log x, log y), or None'
+	pts = [(math.log(x), math.log(y)) for x, y in zip(xs, ys) if x > 0 and y > 0]
+	if len(pts) < 2:
+		return None
+	mx = sum(x for x, _ in pts) / len(pts)
+	my = sum(y for _, y in pts) / len(pts)
+	den = sum((x - mx)**2 for x, _ in pts)
+	return sum((x - mx) * (y - my) for x, y in pts) / den if den else None
+
+
+def analyzeScaling(sizes, batches, tolerance):
+	'Returns (fits, failures)'
+	fits = {'phases': {}, 'batch': {}}
+	failures = []
+	done = [s for s in sizes if 'phases' in s and 'timeout' not in s and 'error' not in s]
+	for phase, declared in DECLARED_TIME.items():
+		rows = [s for s in done if phase in s['phases']]
+		cells = [s['cells'] for s in rows]
+		fit = {
+			'time': fitExponent(cells, [s['phases'][phase]['seconds'] for s in rows]),
+			'memory': fitExponent(cells, [s['phases'][phase]['peakBytes'] for s in rows]),
+		}
+		fits['phases'][phase] = fit
+		if fit['time'] is not None and fit['time'] > declared + tolerance:
+			failures.append("{} time grows as cells^{:.2f} (declared {})".format(phase, fit['time'], declared))
+		if fit['memory'] is not None and fit['memory'] > DECLARED_MEMORY + tolerance:
+			failures.append("{} memory grows as cells^{:.2f} (declared {})".format(phase, fit['memory'], DECLARED_MEMORY))
+	for s in sizes:
+		if 'timeout' in s:
+			failures.append("{}x{} did not finish in time".format(s['width'], s['height']))
+		elif 'error' in s:
+			failures.append("{}x{} failed: {}".format(s['width'], s['height'], s['error']))
+
+	levels = [b['levels'] for b in batches]
+	for key in ('seconds', 'retainedBytes'):
+		fit = fitExponent(levels, [b[key] for b in batches])
+		fits['batch'][key] = fit
+		if fit is not None and fit > DECLARED_BATCH + tolerance:
+			failures.append("batch {} grows as levels^{:.2f} (declared {})".format(key, fit, DECLARED_BATCH))
+	return fits, failures
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts]")
+	parser.add_option("--engine", type="choice", choices=list(ENGINES), default='grid', help="Engine to benchmark (default: %default)")
+	parser.add_option("-S", "--sizes", default=DEFAULT_SIZES, help="Grid sizes, as WxH,... (default: %default)")
+	parser.add_option("-B", "--batches", default=DEFAULT_BATCHES, help="Batch sizes at the default grid size (default: %default)")
+	parser.add_option("-n", "--levels", type="int", default=3, help="Levels generated per grid size (default: %default)")
+	parser.add_option("-s", "--seed", type="int", default=0)
+	parser.add_option("-T", "--timeout", type="int", default=120, help="Seconds allowed per grid size (default: %default)")
+	parser.add_option("--tolerance", type="float", default=0.35, help="Allowed excess of the fitted exponents (default: %default)")
+	parser.add_option("-j", "--jobs", type="int", default=1, help="Worker processes (default: %default, as parallel runs skew timings)")
+	parser.add_option("-o", "--output", default=None, help="Write the JSON report here (default: STDOUT)")
+	options, args = parser.parse_args()
+
+	try:
+		sizes = [tuple(int(v) for v in s.split('x')) for s in options.sizes.split(',')]
+		batches = [int(b) for b in options.batches.split(',')]
+	except ValueError:
+		parser.error("bad --sizes or --batches")
+
+	# a fresh process per configuration, so that ru_maxrss is its own
+	with Pool(options.jobs, maxtasksperchild=1) as pool:
+		sizeResults = pool.map(runSize, [(options.engine, w, h, options.levels, options.seed, options.timeout)
+				for w, h in sizes], chunksize=1)
+		batchResults = pool.map(runBatch, [(options.engine, b, options.seed) for b in batches], chunksize=1)
+
+	fits, failures = analyzeScaling(sizeResults, batchResults, options.tolerance)
+	report = {
+		'engine': options.engine,
+		'sizes': sizeResults,
+		'batches': batchResults,
+		'declared': {'time': DECLARED_TIME, 'memory': DECLARED_MEMORY, 'batch': DECLARED_BATCH},
+		'tolerance': options.tolerance,
+		'fits': fits,
+		'failures': failures,
+	}
+	out = open(options.output, 'w') if options.output else sys.stdout
+	json.dump(report, out, indent='\t')
+	out.write('\n')
+	if out is not sys.stdout:
+		out.close()
+	for f in failures:
+		sys.stderr.write("FAIL: " + f + "\n")
+	sys.exit(1 if failures else 0)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Fit the probability formulas of BOOMLevel to a target difficulty curve.
+#
+# boomcalibrate.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The walls layout of a level (BOOMLevel.genLayout) does not depend on the
+# probabilities being tuned, so each worker builds the seeded layouts once
+# and keeps them around: evaluating a candidate profile only re-runs
+# BOOMLevel.populate on copies of them. Population is seeded too, so all
+# the candidates are compared on the very same random draws and the search
+# is deterministic.
+#
+# The target is a JSON object mapping metric names (any numeric column of
+# boomanalyze.py) to a piecewise-linear curve given as [[level, value], ...],
+# e.g. {"enemies": [[1, 5], [79, 18]], "coins": [[1, 20], [79, 12]]}.
+# The resulting profile can be loaded by boomlevelgen.py with -p.
+
+from multiprocessing import Pool
+from optparse import OptionParser
+import json
+import random
+
+import boomlevelgen
+from boomlevelgen import BOOMLevel, N_LEVELS
+from boomanalyze import analyze
+
+DEFAULT_TARGET = {
+	'enemies': [[1, 5], [N_LEVELS - 1, 18]],
+	'coins': [[1, 20], [N_LEVELS - 1, 14]],
+	'breakableRatio': [[1, 0.6], [N_LEVELS - 1, 0.6]],
+}
+
+# (profile key, sub-key, initial value, min, max)
+PARAMS = [
+	('enemy', 'base', 1/25., 0., 0.5),
+	('enemy', 'exponent', 0.5, 0., 2.),
+	('enemy', 'scale', 40., 1., 400.),
+	('breakable', 'regular', 1/5., 0., 1.),
+	('breakable', 'random', 1/6., 0., 1.),
+	('breakable', 'walkers', 1. / BOOMLevel.WIDTH, 0., 1.),
+	('coin', None, 1/8., 0., 1.),
+]
+
+# which profile keys can affect a metric, by metric name prefix
+AFFECTS = {
+	'enemy': ('enemies', 'enemy', 'distEnemy'),
+	'coin': ('coins', 'distCoin', 'breakable', 'wallDensity'),
+	'breakable': ('breakable', 'wallDensity', 'coins', 'distCoin'),
+}
+
+# per-process cache: (seed, level, sample) -> layout snapshot
+_layouts = {}
+
+
+def interpolate(curve, level):
+	'Evaluates a piecewise-linear curve [[level, value], ...] at `level`'
+	curve = sorted(curve)
+	if level <= curve[0][0]:
+		return curve[0][1]
+	for (l0, v0), (l1, v1) in zip(curve, curve[1:]):
+		if level <= l1:
+			return v0 + (v1 - v0) * (level - l0) / (l1 - l0)
+	return curve[-1][1]
+
+
+def makeProfile(values):
+	profile = {}
+	for (key, sub, _, _, _), v in zip(PARAMS, values):
+		if sub is None:
+			profile[key] = v
+		else:
+			profile.setdefault(key, {})[sub] = v
+	return profile
+
+
+def layout(seed, level, sample, opts):
+	key = (seed, level, sample)
+	if key not in _layouts:
+		random.seed('layout:{}:{}:{}'.format(seed, level, sample))
+		levelGen = BOOMLevel(level, **opts)
+		levelGen.genLayout()
+		_layouts[key] = ([row[:] for row in levelGen.grid], levelGen.symmetry,
+				levelGen.wallsAlg, levelGen.posBosses)
+	return _layouts[key]
+
+
+def evaluateLevel(task):
+	'''Worker: populates all the cached layouts of a level with the given
+	profile. Returns (level, {metric: mean value}).'''
+	profile, level, samples, seed, opts, metrics = task
+	boomlevelgen.quiet = True
+	sums = dict.fromkeys(metrics, 0.)
+	for sample in range(samples):
+		grid, symmetry, wallsAlg, posBosses = layout(seed, level, sample, opts)
+		levelGen = BOOMLevel(level, profile = profile, **opts)
+		levelGen.grid = [row[:] for row in grid]
+		levelGen.symmetry = symmetry
+		levelGen.wallsAlg = wallsAlg
+		levelGen.posBosses = posBosses
+		random.seed('populate:{}:{}:{}'.format(seed, level, sample))
+		row = analyze(levelGen.populate())
+		for m in metrics:
+			sums[m] += row[m]
+	return level, {m: v / samples for m, v in sums.items()}
+
+
+class Calibrator:
+	def __init__(self, pool, target, levels, samples, seed, opts):
+		self.pool = pool
+		self.target = target
+		self.levels = levels
+		self.samples = samples
+		self.seed = seed
+		self.opts = opts
+		self.evaluations = 0
+
+	def error(self, values):
+		'Sum of the squared relative errors of all metrics at all levels'
+		profile = makeProfile(values)
+		metrics = sorted(self.target)
+		tasks = [(profile, level, self.samples, self.seed, self.opts, metrics) for level in self.levels]
+		err = 0.
+		for level, means in self.pool.imap_unordered(evaluateLevel, tasks):
+			for m in metrics:
+				want = interpolate(self.target[m], level)
+				err += ((means[m] - want) / max(abs(want), 1e-3))**2
+		self.evaluations += 1
+		return err
+
+	def fit(self, maxEvaluations = 300, tolerance = 1e-3):
+		'''Coordinate descent with step halving over the parameters which can
+		affect the target metrics. Returns (best values, best error).'''
+		free = [n for n, p in enumerate(PARAMS)
+				if any(m.startswith(AFFECTS[p[0]]) for m in self.target)]
+		values = [p[2] for p in PARAMS]
+		steps = [(p[4] - p[3]) / 8. for p in PARAMS]
+		best = self.error(values)
+		boomlevelgen.log_err("initial error: {:.4f}".format(best))
+		while self.evaluations < maxEvaluations and any(steps[n] > tolerance * (PARAMS[n][4] - PARAMS[n][3]) for n in free):
+			improved = False
+			for n in free:
+				for sign in (1, -1):
+					v = min(PARAMS[n][4], max(PARAMS[n][3], values[n] + sign * steps[n]))
+					if v == values[n]:
+						continue
+					trial = values[:]
+					trial[n] = v
+					err = self.error(trial)
+					if err < best:
+						best, values, improved = err, trial, True
+						key, sub = PARAMS[n][:2]
+						boomlevelgen.log_err("[{}] {} = {:.5g}: error {:.4f}".format(
+							self.evaluations, key + '.' + sub if sub else key, v, best))
+						break
+			if not improved:
+				steps = [s / 2. for s in steps]
+		return values, best
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts] PROFILE")
+	parser.add_option("-T", "--target", metavar="FILE", help="JSON file with the target curves (default: a built-in ramp)")
+	parser.add_option("-n", "--samples", type="int", default=20, help="Seeded generations per level (default: %default)")
+	parser.add_option("-s", "--seed", type="int", default=0, help="Seed for the sampled layouts, so calibrations are reproducible (default: %default)")
+	parser.add_option("-L", "--levels", default="1-{}".format(N_LEVELS - 1), help="Level numbers to fit, as a range (default: %default)")
+	parser.add_option("-m", "--maxEvaluations", type="int", default=300, help="Max number of candidate profiles to try (default: %default)")
+	parser.add_option("-t", "--faithfulThemes", action="store_true", default=False, help="Use the original themes for the levels")
+	parser.add_option("-e", "--faithfulEnemies", action="store_true", default=False, help="Put enemies according to the original levels")
+	parser.add_option("-d", "--difficulty", default='normal', help="Difficulty (easy, normal)")
+	parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: one per CPU)")
+	parser.add_option("-v", "--verbose", action="store_false", dest="quiet", default=True, help="Be more verbose (on the stderr)")
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("need the output profile file")
+	boomlevelgen.quiet = options.quiet
+
+	target = DEFAULT_TARGET
+	if options.target:
+		with open(options.target) as f:
+			target = json.load(f)
+	first, _, last = options.levels.partition('-')
+	levels = range(int(first), int(last or first) + 1)
+	opts = dict(faithfulThemes = options.faithfulThemes,
+			faithfulEnemies = options.faithfulEnemies,
+			difficulty = options.difficulty)
+
+	with Pool(options.jobs) as pool:
+		calibrator = Calibrator(pool, target, levels, options.samples, options.seed, opts)
+		values, err = calibrator.fit(options.maxEvaluations)
+
+	profile = makeProfile(values)
+	profile['fit'] = {
+		'target': target,
+		'error': err,
+		'evaluations': calibrator.evaluations,
+		'samples': options.samples,
+		'seed': options.seed,
+		'difficulty': options.difficulty,
+	}
+	with open(args[0], 'w') as f:
+		json.dump(profile, f, indent='\t')
+		f.write('\n')
+	print("Wrote {} (error {:.4f} after {} evaluations)".format(args[0], err, calibrator.evaluations))
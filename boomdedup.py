@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Deduplication index for generated levels.
+#
+# boomdedup.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Levels are stored in a sqlite file under a canonical form, i.e. the
+# smallest of the four variants obtained by mirroring the grid as
+# BOOMLevel.symmetrize does (identity, axial X, axial Y and central).
+# Near-duplicates are found by bit-sampling LSH on the walls bitmap (fixed
+# and breakable blocks): each band samples a fixed set of cells, and two
+# levels whose walls differ in few cells are very likely to share a band.
+#
+# The generated walls are far from random: most cells are free, and every
+# 'regular' level has the same pillars (the cells at odd x and odd y, which
+# are still sampled, as in the other levels they are walls half the time).
+# So some buckets (e.g. the one with no walls in the band) are shared by
+# many unrelated levels, and grow with the index: a bucket holding more
+# than BUCKET_CAP levels is dropped, as it only tells that they share a
+# common pattern, and every lookup hitting it would compare the query to
+# all of them. The bands are long, and as many as needed to miss at most
+# MISS_RATE of the levels at exactly maxDistance: the closer ones are
+# found more surely.
+
+from hashlib import blake2b
+from math import ceil, log
+from operator import itemgetter
+from random import Random
+import sqlite3
+
+# chars counting as a wall in the walls bitmap
+WALL_TILES = '12'
+
+# the table maps every ASCII char to '0', except walls which become '1'
+WALLS_TABLE = str.maketrans({chr(c): '1' if chr(c) in WALL_TILES else '0' for c in range(128)})
+
+
+class DedupIndex:
+	# cells sampled by each band (at most 48, see bandKeys)
+	BITS_PER_BAND = 40
+	# max probability of missing a level at maxDistance, which sets the number of bands
+	MISS_RATE = 0.01
+	MAX_BANDS = 128
+	# max number of levels in a bucket, past which it's dropped
+	BUCKET_CAP = 32
+	LSH_SEED = 0xB00
+
+	def __init__(self, path, width = 15, height = 13, maxDistance = None):
+		self.width = width
+		self.height = height
+		ncells = width * height
+		# max number of differing wall cells for two levels to be near-duplicates
+		self.maxDistance = maxDistance if maxDistance is not None else ncells // 20
+		# the 4 symmetries as permutations of the flattened grid indices
+		rows = [list(range(y * width, (y + 1) * width)) for y in range(height)]
+		self.perms = [
+			None,
+			[i for row in reversed(rows) for i in row],
+			[i for row in rows for i in reversed(row)],
+			[i for row in reversed(rows) for i in reversed(row)],
+		]
+		rng = Random(DedupIndex.LSH_SEED)
+		bits = min(DedupIndex.BITS_PER_BAND, ncells)
+		self.bands = [sorted(rng.sample(range(ncells), bits))
+				for _ in range(DedupIndex.numBands(ncells, bits, self.maxDistance))]
+		self.samplers = [itemgetter(*band) for band in self.bands]
+
+		self.db = sqlite3.connect(path)
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS levels (
+				id INTEGER PRIMARY KEY,
+				hash BLOB UNIQUE NOT NULL,
+				walls BLOB NOT NULL,
+				source TEXT
+			);
+			CREATE TABLE IF NOT EXISTS lsh (
+				key INTEGER NOT NULL,
+				level INTEGER NOT NULL
+			);
+			CREATE INDEX IF NOT EXISTS lsh_key ON lsh (key);
+			-- number of levels in each bucket, including the ones of dropped buckets
+			CREATE TABLE IF NOT EXISTS buckets (
+				key INTEGER PRIMARY KEY,
+				size INTEGER NOT NULL
+			);
+			CREATE TABLE IF NOT EXISTS meta (lsh TEXT NOT NULL);
+		''')
+		# the band keys depend on the parameters: recompute them if the
+		# index was built with other ones
+		params = '{} {} {} {} {}'.format(width, height, DedupIndex.LSH_SEED, DedupIndex.BUCKET_CAP, self.bands)
+		row = self.db.execute('SELECT lsh FROM meta').fetchone()
+		if row is None or row[0] != params:
+			self.reindex()
+			self.db.execute('DELETE FROM meta')
+			self.db.execute('INSERT INTO meta VALUES (?)', (params,))
+			self.db.commit()
+
+	@staticmethod
+	def numBands(ncells, bits, distance):
+		'''The number of bands of `bits` cells each needed to find a level at
+		`distance` with probability 1 - MISS_RATE'''
+		# probability that a band samples none of the differing cells
+		p = 1.
+		for i in range(bits):
+			p *= max(0, ncells - distance - i) / (ncells - i)
+		if p >= 1:
+			return 1
+		if p <= 0:
+			return DedupIndex.MAX_BANDS
+		return min(DedupIndex.MAX_BANDS, ceil(log(DedupIndex.MISS_RATE) / log(1 - p)))
+
+	def reindex(self):
+		'Recomputes the band keys of all the indexed levels'
+		ncells = self.width * self.height
+		self.db.execute('DELETE FROM lsh')
+		self.db.execute('DELETE FROM buckets')
+		for id, blob in self.db.execute('SELECT id, walls FROM levels').fetchall():
+			bitmap = format(int.from_bytes(blob, 'big'), '0{}b'.format(ncells))
+			self.insertKeys(id, self.bitmapKeys(bitmap))
+
+	def insertKeys(self, id, keys):
+		'Puts level `id` in the buckets `keys`, dropping the ones which overflow'
+		sizes = dict(self.db.execute('SELECT key, size FROM buckets WHERE key IN ({})'
+				.format(','.join('?' * len(keys))), keys).fetchall())
+		self.db.executemany('INSERT OR REPLACE INTO buckets (key, size) VALUES (?, ?)',
+				((key, sizes.get(key, 0) + 1) for key in keys))
+		self.db.executemany('INSERT INTO lsh (key, level) VALUES (?, ?)',
+				((key, id) for key in keys if sizes.get(key, 0) < DedupIndex.BUCKET_CAP))
+		self.db.executemany('DELETE FROM lsh WHERE key = ?',
+				((key,) for key in keys if sizes.get(key, 0) == DedupIndex.BUCKET_CAP))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		self.db.commit()
+		self.db.close()
+
+	def variants(self, grid):
+		'Returns the 4 symmetric variants of the grid string'
+		if len(grid) != self.width * self.height:
+			raise ValueError("grid has {} cells, expected {}".format(len(grid), self.width * self.height))
+		return [grid if p is None else ''.join([grid[i] for i in p]) for p in self.perms]
+
+	@staticmethod
+	def wallsOf(grid):
+		'Returns the walls bitmap of a grid string as an int'
+		return int(grid.translate(WALLS_TABLE), 2)
+
+	def bandKeys(self, grid):
+		return self.bitmapKeys(grid.translate(WALLS_TABLE))
+
+	def bitmapKeys(self, bitmap):
+		'Returns the band keys of a walls bitmap, as a string of 0 and 1'
+		# pack the band number together with its bucket (< 2^48) into a single key
+		return [(n << 48) | int(''.join(sample(bitmap)), 2) for n, sample in enumerate(self.samplers)]
+
+	def lookup(self, grid):
+		"""Returns (id, distance, exact) for the closest indexed level within
+		maxDistance wall cells from `grid`, or None. `exact` is True if the
+		level is the same as `grid` up to symmetry."""
+		variants = self.variants(grid)
+		canon = min(variants)
+		row = self.db.execute('SELECT id FROM levels WHERE hash = ?',
+				(blake2b(canon.encode(), digest_size=16).digest(),)).fetchone()
+		if row:
+			return row[0], 0, True
+
+		keys = set()
+		for v in variants:
+			keys.update(self.bandKeys(v))
+		keys = list(keys)
+		# the keys of dropped buckets have no rows in lsh
+		candidates = self.db.execute(
+				'SELECT id, walls FROM levels WHERE id IN (SELECT level FROM lsh WHERE key IN ({}))'
+				.format(','.join('?' * len(keys))), keys).fetchall()
+		if not candidates:
+			return None
+
+		walls = [self.wallsOf(v) for v in variants]
+		best = None
+		for id, blob in candidates:
+			other = int.from_bytes(blob, 'big')
+			dist = min(bin(w ^ other).count('1') for w in walls)
+			if dist <= self.maxDistance and (best is None or dist < best[1]):
+				best = id, dist, False
+		return best
+
+	def add(self, grid, source = None):
+		'Indexes `grid`. Returns False if it was already in the index.'
+		canon = min(self.variants(grid))
+		walls = self.wallsOf(canon)
+		cur = self.db.execute('INSERT OR IGNORE INTO levels (hash, walls, source) VALUES (?, ?, ?)',
+				(blake2b(canon.encode(), digest_size=16).digest(),
+				walls.to_bytes((self.width * self.height + 7) // 8, 'big'), source))
+		if cur.rowcount == 0:
+			return False
+		self.insertKeys(cur.lastrowid, self.bandKeys(canon))
+		return True
+
+	def __len__(self):
+		return self.db.execute('SELECT COUNT(*) FROM levels').fetchone()[0]
+
+
+if __name__ == '__main__':
+	from optparse import OptionParser
+	from boomlevelgen import BOOMLevel, LevelPack
+
+	parser = OptionParser(usage="%prog [opts] INDEX PACK...")
+	parser.add_option("-q", "--query", action="store_true", default=False, help="Only report duplicates, don't add the levels to the index")
+	parser.add_option("-m", "--maxDistance", type="int", default=None, help="Max number of differing wall cells for near-duplicates")
+	options, args = parser.parse_args()
+	if len(args) < 2:
+		parser.error("need an index file and at least one pack")
+
+	with DedupIndex(args[0], BOOMLevel.WIDTH, BOOMLevel.HEIGHT, options.maxDistance) as index:
+		for path in args[1:]:
+			with open(path) as f:
+				pack = LevelPack(f.read())
+			for num in sorted(pack.spans):
+				grid = pack.grid(num)
+				source = '{}:{}'.format(path, num)
+				match = index.lookup(grid)
+				if match:
+					id, dist, exact = match
+					other = index.db.execute('SELECT source FROM levels WHERE id = ?', (id,)).fetchone()[0]
+					print("{}: {} of {} (distance {})".format(source,
+						'duplicate' if exact else 'near-duplicate', other, dist))
+				if not options.query and not match:
+					index.add(grid, source)
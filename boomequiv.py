@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Check that a level generator engine behaves like the reference one.
+#
+# boomequiv.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Two large seeded samples of levels are generated, one with the reference
+# engine and one with the candidate, and their distributions are compared:
+# numeric metrics with the two-sample Kolmogorov-Smirnov test, categorical
+# ones (symmetry, walls algorithm, enemy types) with the chi-square test of
+# homogeneity. The candidate passes if no test rejects at the given
+# significance level (Bonferroni-corrected over all the tests).
+#
+# An engine is given as a name of boomlevelgen.ENGINES, optionally followed
+# by '+fundamental' to turn on fundamental-domain generation, e.g.
+# 'bitboard+fundamental'.
+
+from math import exp, lgamma, log, sqrt
+from multiprocessing import Pool
+from optparse import OptionParser
+import random
+import sys
+
+import boomlevelgen
+from boomlevelgen import ENGINES, N_LEVELS, tiles
+from boomanalyze import analyze
+
+WALLS_ALGS = ('walkers', 'regular', 'random')
+
+COUNTED_TILES = {
+	'blank': tiles['blank'],
+	'fixed': tiles['fixed'],
+	'breakable': tiles['breakable'],
+	'coin': tiles['coin'],
+	'teleport': tiles['teleport'],
+}
+
+
+def parseEngine(spec):
+	name, _, flags = spec.partition('+')
+	if name not in ENGINES or flags not in ('', 'fundamental'):
+		raise ValueError("unknown engine '{}'".format(spec))
+	return ENGINES[name], flags == 'fundamental'
+
+
+def sampleLevels(task):
+	'Worker: generates the levels with the given seeds, returns their stats'
+	spec, seeds, opts = task
+	boomlevelgen.quiet = True
+	cls, fundamental = parseEngine(spec)
+	out = []
+	levelGen = None
+	for seed in seeds:
+		random.seed(seed)
+		# cycle over all the levels but the last one, which is a fixed stage
+		level = 1 + seed % (N_LEVELS - 1)
+		if levelGen is None:
+			levelGen = cls(level, fundamental = fundamental, **opts)
+		else:
+			levelGen.reset(level, fundamental = fundamental, **opts)
+		grid = levelGen.genGrid()
+		row = analyze(grid)
+		out.append({
+			'tiles': {name: grid.count(t) for name, t in COUNTED_TILES.items()},
+			'enemies': row['enemies'],
+			'enemyTypes': [row['enemy' + e] for e in tiles['enemy']],
+			'wallDensity': row['wallDensity'],
+			'symmetry': levelGen.symmetry,
+			'wallsAlg': levelGen.wallsAlg,
+			'regionsBeforeRepair': levelGen.regionsBeforeRepair,
+			'walkerSteps': list(levelGen.walkerSteps),
+		})
+	return out
+
+
+def generate(pool, spec, seeds, opts, chunk = 200):
+	tasks = [(spec, seeds[i:i+chunk], opts) for i in range(0, len(seeds), chunk)]
+	return [lvl for part in pool.imap(sampleLevels, tasks) for lvl in part]
+
+
+def ksTest(a, b):
+	'Two-sample Kolmogorov-Smirnov test. Returns (D, p-value).'
+	a = sorted(a)
+	b = sorted(b)
+	n, m = len(a), len(b)
+	if not n or not m:
+		return 0., 1.
+	i = j = 0
+	d = 0.
+	while i < n and j < m:
+		v = min(a[i], b[j])
+		while i < n and a[i] == v: i += 1
+		while j < m and b[j] == v: j += 1
+		d = max(d, abs(i / n - j / m))
+	en = sqrt(n * m / (n + m))
+	lam = (en + 0.12 + 0.11 / en) * d
+	if lam < 1e-3:
+		return d, 1.
+	p = 2 * sum((-1)**(k-1) * exp(-2 * k * k * lam * lam) for k in range(1, 101))
+	return d, min(1., max(0., p))
+
+
+def gammaQ(a, x):
+	'Regularized upper incomplete gamma function Q(a, x)'
+	if x <= 0:
+		return 1.
+	if x < a + 1:
+		# series for P(a, x)
+		term = total = 1. / a
+		n = a
+		for _ in range(1000):
+			n += 1
+			term *= x / n
+			total += term
+			if abs(term) < abs(total) * 1e-15:
+				break
+		return 1. - total * exp(-x + a * log(x) - lgamma(a))
+	# continued fraction for Q(a, x) (modified Lentz)
+	tiny = 1e-300
+	b = x + 1 - a
+	c = 1. / tiny
+	d = 1. / b
+	h = d
+	for i in range(1, 1000):
+		an = -i * (i - a)
+		b += 2
+		d = an * d + b
+		d = tiny if abs(d) < tiny else d
+		c = b + an / c
+		c = tiny if abs(c) < tiny else c
+		d = 1. / d
+		delta = d * c
+		h *= delta
+		if abs(delta - 1) < 1e-15:
+			break
+	return exp(-x + a * log(x) - lgamma(a)) * h
+
+
+def chiSquareTest(countsA, countsB):
+	'''Chi-square test of homogeneity of two histograms (lists of counts
+	over the same categories). Returns (statistic, p-value).'''
+	cats = [(a, b) for a, b in zip(countsA, countsB) if a + b > 0]
+	na = sum(a for a, _ in cats)
+	nb = sum(b for _, b in cats)
+	if len(cats) < 2 or not na or not nb:
+		return 0., 1.
+	total = na + nb
+	stat = 0.
+	for a, b in cats:
+		ea = na * (a + b) / total
+		eb = nb * (a + b) / total
+		stat += (a - ea)**2 / ea + (b - eb)**2 / eb
+	return stat, gammaQ((len(cats) - 1) / 2., stat / 2.)
+
+
+def histogram(values, cats):
+	return [sum(1 for v in values if v == c) for c in cats]
+
+
+def compare(ref, cand):
+	'Runs all the tests. Returns a list of (test name, kind, statistic, p-value).'
+	results = []
+	for name in COUNTED_TILES:
+		results.append(('tiles.' + name, 'KS') + ksTest(
+			[l['tiles'][name] for l in ref], [l['tiles'][name] for l in cand]))
+	results.append(('enemies', 'KS') + ksTest([l['enemies'] for l in ref], [l['enemies'] for l in cand]))
+	for alg in WALLS_ALGS:
+		results.append(('wallDensity.' + alg, 'KS') + ksTest(
+			[l['wallDensity'] for l in ref if l['wallsAlg'] == alg],
+			[l['wallDensity'] for l in cand if l['wallsAlg'] == alg]))
+	results.append(('regionsBeforeRepair', 'KS') + ksTest(
+		[l['regionsBeforeRepair'] for l in ref if l['regionsBeforeRepair'] is not None],
+		[l['regionsBeforeRepair'] for l in cand if l['regionsBeforeRepair'] is not None]))
+	results.append(('walkerSteps', 'KS') + ksTest(
+		[s for l in ref for s in l['walkerSteps']], [s for l in cand for s in l['walkerSteps']]))
+	results.append(('symmetry', 'chi2') + chiSquareTest(
+		histogram([l['symmetry'] for l in ref], range(4)),
+		histogram([l['symmetry'] for l in cand], range(4))))
+	results.append(('wallsAlg', 'chi2') + chiSquareTest(
+		histogram([l['wallsAlg'] for l in ref], WALLS_ALGS),
+		histogram([l['wallsAlg'] for l in cand], WALLS_ALGS)))
+	results.append(('enemyTypes', 'chi2') + chiSquareTest(
+		[sum(l['enemyTypes'][k] for l in ref) for k in range(len(tiles['enemy']))],
+		[sum(l['enemyTypes'][k] for l in cand) for k in range(len(tiles['enemy']))]))
+	return results
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts] CANDIDATE")
+	parser.add_option("-r", "--reference", default='grid', help="Reference engine (default: %default)")
+	parser.add_option("-n", "--samples", type="int", default=5000, help="Levels generated per engine (default: %default)")
+	parser.add_option("-s", "--seed", type="int", default=0)
+	parser.add_option("-a", "--alpha", type="float", default=0.01, help="Overall significance level (default: %default)")
+	parser.add_option("-P", "--paired", action="store_true", default=False, help="Use the same seeds for both engines")
+	parser.add_option("-e", "--faithfulEnemies", action="store_true", default=False)
+	parser.add_option("-d", "--difficulty", default='normal', help="Difficulty (easy, normal)")
+	parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: one per CPU)")
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("need the candidate engine")
+	for spec in (options.reference, args[0]):
+		try:
+			parseEngine(spec)
+		except ValueError as e:
+			parser.error(str(e))
+
+	opts = dict(faithfulEnemies = options.faithfulEnemies, difficulty = options.difficulty)
+	n = options.samples
+	refSeeds = list(range(options.seed, options.seed + n))
+	candSeeds = refSeeds if options.paired else list(range(options.seed + n, options.seed + 2 * n))
+	with Pool(options.jobs) as pool:
+		ref = generate(pool, options.reference, refSeeds, opts)
+		cand = generate(pool, args[0], candSeeds, opts)
+
+	results = compare(ref, cand)
+	threshold = options.alpha / len(results)
+	failed = 0
+	print("{} vs {}, {} levels each (per-test threshold p < {:.2g})".format(
+		args[0], options.reference, n, threshold))
+	for name, kind, stat, p in results:
+		ok = p >= threshold
+		failed += not ok
+		print("  {:<22} {:<5} stat = {:<10.4g} p = {:<10.4g} {}".format(name, kind, stat, p, 'pass' if ok else 'FAIL'))
+	print("FAIL: {} test(s) rejected".format(failed) if failed else "PASS")
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Build a bank of validated walls layouts for boomlevelgen.py -b.
+#
+# boomlayoutbank.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Each layout is the grid left by BOOMLevel.genLayout on a non-boss level:
+# players, teleports and the repaired walls, before any enemy, coin or
+# breakable wall is added. A layout is stored only if it has both players
+# and a single connected region; identical layouts are stored once.
+# Running it again on the same bank adds to it.
+
+from multiprocessing import Pool
+from optparse import OptionParser
+import random
+
+import boomlevelgen
+from boomlevelgen import ENGINES, LayoutBank, tiles
+
+
+def buildLayouts(task):
+	'Worker: generates the layouts with the given seeds, returns the valid ones'
+	engine, seeds = task
+	boomlevelgen.quiet = True
+	out = []
+	for seed in seeds:
+		random.seed('layout/{}'.format(seed))
+		levelGen = ENGINES[engine](level = 1)
+		levelGen.genLayout()
+		grid = ''.join(''.join(row) for row in levelGen.grid)
+		if grid.count(tiles['player1']) != 1 or grid.count(tiles['player2']) != 1:
+			continue
+		if len(levelGen.findRegions()) != 1:
+			continue
+		out.append((levelGen.symmetry, levelGen.wallsAlg, grid, levelGen.regionsBeforeRepair))
+	return out
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts] BANK")
+	parser.add_option("-n", "--layouts", type="int", default=10000, help="Layouts to generate (default: %default)")
+	parser.add_option("-s", "--seed", type="int", default=0, help="First seed (default: %default)")
+	parser.add_option("--engine", type="choice", choices=list(ENGINES), default='bitboard', help="Engine generating the layouts (default: %default)")
+	parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: one per CPU)")
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("need the bank file")
+
+	chunk = 200
+	seeds = range(options.seed, options.seed + options.layouts)
+	tasks = [(options.engine, seeds[i:i+chunk]) for i in range(0, len(seeds), chunk)]
+	added = duplicates = 0
+	with LayoutBank(args[0]) as bank, Pool(options.jobs) as pool:
+		for layouts in pool.imap(buildLayouts, tasks):
+			for layout in layouts:
+				if bank.add(*layout):
+					added += 1
+				else:
+					duplicates += 1
+		counts = sorted(bank.counts.items())
+	rejected = options.layouts - added - duplicates
+
+	print("Added {} layouts ({} duplicates, {} rejected)".format(added, duplicates, rejected))
+	for (symmetry, wallsAlg), n in counts:
+		print("  symmetry {} {:<8} {}".format(symmetry, wallsAlg, n))
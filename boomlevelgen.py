@@ -18,27 +18,56 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from random import randint, random, sample
+from random import randint, random, sample, seed as randomSeed
 from sys import stderr, stdout
 from math import exp
 from optparse import OptionParser
 from datetime import datetime
-
-def printHeader():
-	print("""<?xml version="1.0" encoding="UTF-8"?>
+from time import perf_counter
+import io
+import json
+import plistlib
+import re
+import sqlite3
+import zlib
+from collections import deque
+
+# Output templates. They are compiled once at import time and filled with
+# plain '%' formatting, so serializing a level costs a single string op.
+PLIST_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
 <plist version="1.0">
 <dict>
  <key>LevelDescription</key>
- <array>""")
-
+ <array>
+"""
 
-def printHeaderLifish():
-  print('''{
+PLIST_FOOTER = """ </array>
+</dict>
+</plist>
+"""
+
+PLIST_LEVEL = """  <dict>
+   <key>BGPatternID</key>
+   <integer>%d</integer>
+   <key>BorderID</key>
+   <integer>%d</integer>
+   <key>BreakableBlockID</key>
+   <integer>%d</integer>
+   <key>FixedBlockID</key>
+   <integer>%d</integer>
+   <key>GridDescString</key>
+   <string>%s</string>
+   <key>Time</key>
+   <integer>%d</integer>
+  </dict>
+"""
+
+LIFISH_HEADER = '''{
 \t"name": "Autogenerated Lifish levels",
 \t"author": "boomlevelgen",
 \t"difficulty": "unknown",
-\t"created": "''' + str(datetime.now()) + '''",
+\t"created": "%s",
 \t"comment": "Created with boomlevelgen",
 \t"tracks": [
 \t\t{
@@ -243,17 +272,210 @@ def printHeaderLifish():
 \t\t\t}
 \t\t}
 \t],
-\t"levels": [''')
+\t"levels": [
+'''
+
+LIFISH_FOOTER = "\t]\r\n}\n"
+
+LIFISH_LEVEL = """\t\t{
+\t\t\t"time": %d,
+\t\t\t"num": %d,
+\t\t\t"music": %d,
+\t\t\t"width": %d,
+\t\t\t"height": %d,
+\t\t\t"tileIDs": {
+\t\t\t\t"bg": %d,
+\t\t\t\t"border": %d,
+\t\t\t\t"fixed": %d,
+\t\t\t\t"breakable": %d
+\t\t\t},
+\t\t\t"tilemap": "%s",
+\t\t\t"effects": []%s
+\t\t}%s
+"""
+
+
+def printHeader():
+	stdout.write(PLIST_HEADER)
+
+
+def printHeaderLifish():
+	stdout.write(LIFISH_HEADER % datetime.now())
 
 
 def printFooter():
-	print(""" </array>
-</dict>
-</plist>""")
+	stdout.write(PLIST_FOOTER)
 
 
 def printFooterLifish():
-	print("\t]\r\n}")
+	stdout.write(LIFISH_FOOTER)
+
+
+class PackWriter:
+	"""Writes a pack to the text file `out` as its levels come: begin(), then
+	write(level) for each level, then end(). Subclasses are the output
+	formats, registered in WRITERS."""
+	def __init__(self, out):
+		self.out = out
+
+	def begin(self):
+		pass
+
+	def write(self, level):
+		raise NotImplementedError
+
+	def end(self):
+		pass
+
+
+class PlistWriter(PackWriter):
+	def begin(self):
+		self.out.write(PLIST_HEADER)
+
+	def write(self, level):
+		self.out.write(level.plistEntry())
+
+	def end(self):
+		self.out.write(PLIST_FOOTER)
+
+
+class LifishWriter(PackWriter):
+	def begin(self):
+		self.out.write(LIFISH_HEADER % datetime.now())
+		# the last level written, held back until we know whether it's the
+		# last one of the pack, which must not be followed by a comma
+		self.pending = None
+
+	def write(self, level):
+		self.flush(last = False)
+		# `level` may be a generator which will be reset for the next level
+		self.pending = LevelSnapshot(level)
+
+	def flush(self, last):
+		if self.pending is None:
+			return
+		entry = self.pending.lifishEntry(last)
+		if self.pending.level == N_LEVELS:
+			# the boss of the last stage has its own tile in Lifish
+			entry = entry.replace(tiles['boss'], tiles['lifish_lastboss'])
+		self.out.write(entry)
+		self.pending = None
+
+	def end(self):
+		self.flush(last = True)
+		self.out.write(LIFISH_FOOTER)
+
+
+# output formats selectable with --out
+WRITERS = {
+	'plist': PlistWriter,
+	'lifish': LifishWriter,
+}
+
+
+def writePack(levels, out = stdout, lifish = False):
+	"""Serializes a whole pack of already generated levels into a single
+	buffer and writes it to `out` with one call."""
+	buf = io.StringIO()
+	writer = WRITERS['lifish' if lifish else 'plist'](buf)
+	writer.begin()
+	for lvl in levels:
+		writer.write(lvl)
+	writer.end()
+	out.write(buf.getvalue())
+
+
+def writePackStdlib(levels, out = stdout, lifish = False):
+	"""Like writePack, but goes through plistlib/json. The result is
+	semantically equivalent, but not byte-identical, to writePack's."""
+	if lifish:
+		pack = json.loads(LIFISH_HEADER % datetime.now() + LIFISH_FOOTER)
+		pack['levels'] = [lvl.lifishDict() for lvl in levels]
+		data = (json.dumps(pack, indent='\t') + '\n').encode()
+	else:
+		data = plistlib.dumps({'LevelDescription': [lvl.plistDict() for lvl in levels]})
+	buf = getattr(out, 'buffer', None)
+	if buf is not None:
+		out.flush()
+		buf.write(data)
+	else:
+		out.write(data.decode())
+
+
+# Compressed packs: a header (magic, format version, flags) followed by a
+# zlib stream with the preset dictionary PACK_ZDICT. The dictionary is part
+# of the format: changing it needs a new PACK_VERSION.
+PACK_MAGIC = b'BLZ'
+PACK_VERSION = 1
+PACK_RLE = 1
+# zlib looks back from the end of the dictionary, so the most common strings
+# (the keys repeated in every level, typical rows of tiles) go last.
+PACK_ZDICT = ''.join([
+	LIFISH_HEADER.replace('%s', ''),
+	PLIST_HEADER,
+	PLIST_FOOTER,
+	LIFISH_FOOTER,
+	'0' * 15, '2' * 15, '010101010101010', '101010101010101', '020202020202020',
+	re.sub(r'%[ds]', '', LIFISH_LEVEL),
+	re.sub(r'%[ds]', '', PLIST_LEVEL),
+]).encode()
+
+# runs of at least RLE_MIN equal tiles become '~', the tile, the run length and '.'
+RLE_MIN = 4
+RLE_RUN = re.compile(r'(.)\1{%d,}' % (RLE_MIN - 1))
+RLE_TOKEN = re.compile(r'~(.)(\d+)\.')
+
+
+def rleEncode(grid):
+	return RLE_RUN.sub(lambda m: '~{}{}.'.format(m.group(1), len(m.group(0))), grid)
+
+
+def rleDecode(text):
+	return RLE_TOKEN.sub(lambda m: m.group(1) * int(m.group(2)), text)
+
+
+def rleGrid(m):
+	'Run-length encodes the grid string matched by LevelPack.GRID_RE, which may be empty'
+	group = 1 if m.group(1) is not None else 2
+	start, end = m.start(group) - m.start(), m.end(group) - m.start()
+	return m.group(0)[:start] + rleEncode(m.group(group)) + m.group(0)[end:]
+
+
+def compressPack(text, rle = False):
+	"""Compresses the text of a pack. With `rle`, the grid strings are
+	run-length encoded first."""
+	if rle:
+		text = LevelPack.GRID_RE.sub(rleGrid, text)
+	z = zlib.compressobj(9, zdict = PACK_ZDICT)
+	return PACK_MAGIC + bytes([PACK_VERSION, PACK_RLE if rle else 0]) + \
+			z.compress(text.encode()) + z.flush()
+
+
+def decompressPack(inp, out, chunkSize = 1 << 16):
+	"""Streams the pack compressed by compressPack from the binary file
+	`inp` to the text file `out`, a chunk at a time."""
+	header = inp.read(len(PACK_MAGIC) + 2)
+	if header[:len(PACK_MAGIC)] != PACK_MAGIC or len(header) != len(PACK_MAGIC) + 2:
+		raise ValueError("not a compressed pack")
+	version, flags = header[len(PACK_MAGIC):]
+	if version != PACK_VERSION:
+		raise ValueError("unsupported compressed pack version {}".format(version))
+	z = zlib.decompressobj(zdict = PACK_ZDICT)
+	# undecoded text, kept when a run token may be cut by the chunk boundary
+	carry = ''
+	while True:
+		data = inp.read(chunkSize)
+		text = carry + z.decompress(data).decode() if data else carry + z.flush().decode()
+		carry = ''
+		if flags & PACK_RLE and data:
+			cut = text.rfind('~')
+			if cut >= 0 and '.' not in text[cut:]:
+				text, carry = text[:cut], text[cut:]
+		out.write(rleDecode(text) if flags & PACK_RLE else text)
+		if not data:
+			break
+	if not z.eof:
+		raise ValueError("truncated compressed pack")
 
 
 def log_err(string, end='\n'):
@@ -262,6 +484,9 @@ def log_err(string, end='\n'):
 		stderr.write(string + end)
 
 N_LEVELS = 80
+# max number of tries to generate a level which is not a duplicate
+DEDUP_RETRIES = 20
+quiet = True
 
 tiles = {
 	'player1': 'X',
@@ -286,6 +511,9 @@ tilecolors = {
 }
 nocol = "\033[;0m"
 
+# tile character -> name in `tiles`
+tilenames = {c: name for name, chars in tiles.items() for c in chars}
+
 SYM_NONE = 0
 SYM_AXIAL_X = 1
 SYM_AXIAL_Y = 2
@@ -297,11 +525,228 @@ def color(n):
 	else:
 		return color(tilecolors[n])
 
+def levelSeed(seed, level):
+	'Returns the seed of the random stream of `level` in the pack generated from `seed`'
+	return '{}/{}'.format(seed, level)
+
+
+def loadProfile(path):
+	"""Loads a difficulty profile (as written by boomcalibrate.py) from a JSON
+	file. Any of these keys may be given:
+	  "enemy": {"base": b, "exponent": e, "scale": s}, i.e. probEnemy is b + level**e / s
+	  "breakable": {wallsAlg: probBreakable, ...}
+	  "coin": probCoin
+	"""
+	with open(path) as f:
+		profile = json.load(f)
+	if 'enemy' in profile and not {'base', 'exponent', 'scale'} <= set(profile['enemy']):
+		raise ValueError("profile 'enemy' needs 'base', 'exponent' and 'scale'")
+	return profile
+
+
+class OutOfBudget(Exception):
+	pass
+
+
+class Rejected(Exception):
+	'Raised by BOOMLevel.decided when its `accept` callback turns the level down'
+	pass
+
+# the steps of genGridDescString after which BOOMLevel.decided is called,
+# in order: the symmetry, the teleports, the walls algorithm (before the
+# walls are built) and the complete layout
+DECISIONS = ('symmetry', 'teleports', 'wallsAlg', 'layout')
+
+
+class Budget:
+	"""Time and iteration limits for the generation of a single level.
+	Every potentially unbounded loop asks exhausted() at each iteration and
+	switches to a cheaper fallback when it returns True. `seconds` is
+	counted from start(); `iterations` caps each retry loop on its own.
+	Loops which end by themselves in a few steps anyway, like walkers,
+	only check the time. The default budget is unlimited and never alters
+	the generation."""
+	def __init__(self, seconds = None, iterations = None):
+		self.seconds = seconds
+		self.iterations = iterations
+		self.deadline = None
+		# names of the loops which ran out of budget
+		self.hits = []
+
+	def start(self):
+		if self.seconds is not None:
+			self.deadline = perf_counter() + self.seconds
+
+	def exhausted(self, where, n = None):
+		'''Returns True, recording the hit, if the loop `where` ran out of
+		budget at its n-th iteration. Without `n`, only the time counts.'''
+		if (self.iterations is not None and n is not None and n >= self.iterations) or \
+				(self.deadline is not None and perf_counter() > self.deadline):
+			log_err("[budget] out of budget in {}".format(where))
+			self.hits.append(where)
+			return True
+		return False
+
+
+# Special (boss) stages. Each row is a sequence of cell rules, one char
+# each or a (group) of them, and at most one of them followed by '*' is
+# repeated to fill the width. '@X' is a row of blanks with player X in a
+# random column. The 'band' row is repeated to fill the height between the
+# 'top' and 'bottom' rows, and the bosses are put in it.
+STAGE_TEMPLATES = {
+	# the original final stage: the boss waits in the middle behind two
+	# lines of walls, the players start on the first and the last row
+	'classic': {
+		'top': ['@X', '22w*22', '020*20'],
+		'band': 'eW0*We',
+		'bottom': ['020*20', '22w*22', '@Y'],
+		'bosses': 1,
+	},
+	# an open field of rubble and coins
+	'arena': {
+		'top': ['@X', 'c*', 'r*'],
+		'band': 'r*',
+		'bottom': ['r*', 'c*', '@Y'],
+		'bosses': 2,
+	},
+	# rows of pillars to get through before reaching the boss
+	'gauntlet': {
+		'top': ['@X', 'c*', '(1W)*1', '0*'],
+		'band': 'ew0*we',
+		'bottom': ['0*', '(1W)*1', 'c*', '@Y'],
+		'bosses': 1,
+	},
+	# three bosses behind a thick wall
+	'fortress': {
+		'top': ['@X', '0*', 'W*'],
+		'band': '2r*2',
+		'bottom': ['W*', '0*', '@Y'],
+		'bosses': 3,
+	},
+}
+
+# Random cell rules: rule -> ((probability, tile), ...). Each random cell
+# takes a single draw d and becomes the first tile whose cumulated
+# probability exceeds d. Tile characters are literal cells.
+STAGE_RULES = {
+	'w': ((0.2, tiles['fixed']), (0.8, tiles['breakable'])),
+	'W': ((0.3, tiles['fixed']), (0.7, tiles['breakable'])),
+	'e': ((0.6, tiles['blank']), (0.12, tiles['fixed']), (0.28, tiles['breakable'])),
+	'r': ((0.35, tiles['breakable']), (0.65, tiles['blank'])),
+	'c': ((0.15, tiles['coin']), (0.85, tiles['blank'])),
+}
+STAGE_LITERALS = set(tiles['blank'] + tiles['fixed'] + tiles['breakable'] + tiles['coin'] + tiles['teleport'])
+
+
+def _ruleFunc(choices):
+	(p1, t1), (p2, t2) = choices[0], choices[1]
+	if len(choices) == 2:
+		return lambda d: t1 if d < p1 else t2
+	t3 = choices[2][1]
+	p2 += p1
+	return lambda d: t1 if d < p1 else t2 if d < p2 else t3
+
+
+class StagePlan:
+	"""A stage template compiled for a grid size. The literal cells are baked
+	into a %-format string with a placeholder per random cell, so filling a
+	stage is a single bulk draw, a pass over the random cells and a format.
+	Get the plans with StagePlan.get(), which compiles each one only once."""
+	_cache = {}
+	_funcs = {rule: _ruleFunc(choices) for rule, choices in STAGE_RULES.items()}
+
+	@staticmethod
+	def get(name, width, height):
+		key = (name, width, height)
+		if key not in StagePlan._cache:
+			StagePlan._cache[key] = StagePlan(STAGE_TEMPLATES[name], width, height)
+		return StagePlan._cache[key]
+
+	def __init__(self, template, width, height):
+		self.width = width
+		top, bottom = template['top'], template['bottom']
+		self.bandStart = len(top)
+		self.bandRows = height - len(top) - len(bottom)
+		nbosses = template['bosses']
+		if self.bandRows < 3 or 4 * nbosses > width:
+			raise ValueError("stage doesn't fit in {}x{}".format(width, height))
+		fmt = []
+		# the function of each random cell, in grid order
+		self.funcs = []
+		# (player, index of the first cell of its row)
+		self.spawns = []
+		for y, row in enumerate(top + [template['band']] * self.bandRows + bottom):
+			if row.startswith('@'):
+				self.spawns.append((row[1:], y * width))
+				fmt.append(tiles['blank'] * width)
+				continue
+			for rule in self.expandRow(row):
+				if rule in STAGE_RULES:
+					fmt.append('%s')
+					self.funcs.append(StagePlan._funcs[rule])
+				elif rule in STAGE_LITERALS:
+					fmt.append(rule)
+				else:
+					raise ValueError("unknown stage rule '{}'".format(rule))
+		self.format = ''.join(fmt)
+		# the bosses are evenly spaced in the band and draw their row
+		self.bossCols = [(k + 1) * width // (nbosses + 1) - 1 for k in range(nbosses)]
+		self.bossRow = self.bandStart + (self.bandRows > 3)
+		self.bossRows = self.bandStart + self.bandRows - 3 - self.bossRow + 1
+		self.ndraws = len(self.funcs) + len(self.spawns) + nbosses
+
+	def expandRow(self, row):
+		'Returns the cell rules of a template row, with its * token stretched to the width'
+		tokens = [(tok.strip('()'), star) for tok, star in re.findall(r'(\([^)]*\)|[^*])(\*?)', row)]
+		fill = self.width - sum(len(tok) for tok, star in tokens if not star)
+		cells = ''.join((tok * (fill // len(tok) + 1))[:max(0, fill)] if star else tok for tok, star in tokens)
+		if len(cells) != self.width:
+			raise ValueError("stage row '{}' doesn't fit in width {}".format(row, self.width))
+		return cells
+
+	def fill(self, bossTile):
+		'Returns the grid string of a new random stage and the boss positions'
+		draws = [random() for _ in range(self.ndraws)]
+		n = len(self.funcs)
+		cells = list(self.format % tuple([f(d) for f, d in zip(self.funcs, draws)]))
+		for (player, start), d in zip(self.spawns, draws[n:]):
+			cells[start + int(d * self.width)] = player
+		n += len(self.spawns)
+		# the bosses and their (blank) 3x3 footprints
+		positions = []
+		blank = [tiles['blank']] * 3
+		for bx, d in zip(self.bossCols, draws[n:]):
+			by = self.bossRow + int(d * self.bossRows)
+			for y in range(by, by + 3):
+				cells[y * self.width + bx:y * self.width + bx + 3] = blank
+			cells[by * self.width + bx] = bossTile
+			positions.append((bx, by))
+		return ''.join(cells), positions
+
+
 class BOOMLevel:
 	WIDTH = 15
 	HEIGHT = 13
 
-	def __init__(self, level, faithfulThemes = False, faithfulEnemies = False, difficulty = 'normal'):
+	__slots__ = ('level', 'bgPatternID', 'borderID', 'breakableBlockID', 'fixedBlockID', 'time',
+			'wallsAlg', 'symmetry', 'faithfulThemes', 'faithfulEnemies', 'difficulty', 'profile',
+			'fundamental', 'domain', 'budget', 'bank', 'posBosses', 'grid', 'gridString',
+			'regionsBeforeRepair', 'walkerSteps', 'nav', 'bossStages', 'accept')
+
+	def __init__(self, level, faithfulThemes = False, faithfulEnemies = False, difficulty = 'normal', profile = None,
+			fundamental = False, budget = None, bank = None, bossStages = False,
+			accept = None):
+		self.grid = [['0' for x in range(BOOMLevel.WIDTH)] for y in range(BOOMLevel.HEIGHT)]
+		self.walkerSteps = []
+		self.reset(level, faithfulThemes, faithfulEnemies, difficulty, profile, fundamental, budget, bank,
+				bossStages, accept)
+
+	def reset(self, level, faithfulThemes = False, faithfulEnemies = False, difficulty = 'normal', profile = None,
+			fundamental = False, budget = None, bank = None, bossStages = False,
+			accept = None):
+		"""Makes this a new generator for `level`, as if just constructed with
+		these arguments, but reusing the buffers of the previous one. Anything
+		read from it before (e.g. walkerSteps) must be copied first."""
 		self.level = level
 		self.bgPatternID = 1
 		self.borderID = 1
@@ -313,7 +758,37 @@ class BOOMLevel:
 		self.faithfulThemes = faithfulThemes
 		self.faithfulEnemies = faithfulEnemies
 		self.difficulty = difficulty
-		self.grid = [['0' for x in range(BOOMLevel.WIDTH)] for y in range(BOOMLevel.HEIGHT)]
+		# optional difficulty profile overriding the probability formulas
+		# (see loadProfile)
+		self.profile = profile
+		# if set, symmetric levels are generated on their fundamental domain
+		# only and mirrored once at the end (see genLayoutFundamental)
+		self.fundamental = fundamental
+		# the Domain being generated, when in fundamental mode
+		self.domain = None
+		self.budget = budget if budget is not None else Budget()
+		# if set, the LayoutBank the layouts are taken from (see genLayout)
+		self.bank = bank
+		# if set, boss levels before the last one are special stages too
+		self.bossStages = bossStages
+		# if set, called as accept(self, step) after each step of DECISIONS:
+		# a false result aborts the generation (see decided)
+		self.accept = accept
+		self.posBosses = None
+		if len(self.grid) == BOOMLevel.HEIGHT and len(self.grid[0]) == BOOMLevel.WIDTH:
+			blank = ['0'] * BOOMLevel.WIDTH
+			for row in self.grid:
+				row[:] = blank
+		else:
+			self.grid = [['0' for x in range(BOOMLevel.WIDTH)] for y in range(BOOMLevel.HEIGHT)]
+		self.gridString = None
+		# number of disconnected regions left by the walls algorithm, before
+		# they get joined together (None if not generated yet)
+		self.regionsBeforeRepair = None
+		# number of steps made by each walker of genWallsWithWalkers
+		self.walkerSteps.clear()
+		# navigation data exported with the level, if computed (see navigation)
+		self.nav = None
 
 	def setParameters(self):
 		if self.faithfulThemes:
@@ -329,15 +804,22 @@ class BOOMLevel:
 		self.time = 60 + randint(0, 60 * (self.level // 10 + 1))
 
 	def probEnemy(self):
+		if self.profile and 'enemy' in self.profile:
+			p = self.profile['enemy']
+			return p['base'] + (self.level)**p['exponent'] / p['scale']
 		if self.difficulty == 'easy':
 			return 1/30. + (self.level)**0.3 / 40.
 		else:
 			return 1/25. + (self.level)**0.5 / 40.
 	
 	def probCoin(self):
+		if self.profile and 'coin' in self.profile:
+			return self.profile['coin']
 		return 1 / 8.
 	
 	def probBreakable(self):
+		if self.profile and self.wallsAlg in self.profile.get('breakable', {}):
+			return self.profile['breakable'][self.wallsAlg]
 		if self.wallsAlg == 'regular':
 			return 1 / 5.
 		elif self.wallsAlg == 'random':
@@ -372,8 +854,8 @@ class BOOMLevel:
 			ys -= {BOOMLevel.HEIGHT // 2}
 		else:
 			xs -= {BOOMLevel.WIDTH // 2}
-		px = sample(xs, 1)[0]
-		py = sample(ys, 1)[0]
+		px = sample(sorted(xs), 1)[0]
+		py = sample(sorted(ys), 1)[0]
 		self.grid[py][px] = tiles['player1']
 		log_err("Spawned player 1 in x, y = {}, {}".format(px, py))
 
@@ -390,6 +872,11 @@ class BOOMLevel:
 		self.grid[py][px] = tiles['player2']
 		log_err("Spawned player 2 in x, y = {}, {}".format(px, py))
 
+	@staticmethod
+	def bossFootprint(bx, by):
+		'The cells (x, y) taken by a boss at bx, by: the 3x3 square with it at its top-left corner'
+		return [(x, y) for y in range(by, by + 3) for x in range(bx, bx + 3)]
+
 	def spawnBosses(self, numBosses):
 		positions = []
 
@@ -398,20 +885,31 @@ class BOOMLevel:
 			by = randint(0, BOOMLevel.HEIGHT - 4)
 
 			occupied = lambda x, y: any(self.grid[j][i] in (tiles['player1'], tiles['player2']) \
-							for i in range(x, x + 3) for j in range(y, y + 3))
+							for i, j in BOOMLevel.bossFootprint(x, y))
 
+			tries = 0
 			while occupied(bx, by):
-				bx = randint(0, BOOMLevel.WIDTH - 4)
-				by = randint(0, BOOMLevel.HEIGHT - 4)
+				tries += 1
+				if self.budget.exhausted('spawnBosses', tries):
+					# take the first free spot, if any
+					free = [(x, y) for y in range(BOOMLevel.HEIGHT - 3)
+							for x in range(BOOMLevel.WIDTH - 3) if not occupied(x, y)]
+					if not free:
+						break
+					bx, by = free[0]
+				else:
+					bx = randint(0, BOOMLevel.WIDTH - 4)
+					by = randint(0, BOOMLevel.HEIGHT - 4)
+			if occupied(bx, by):
+				log_err("No room for boss {}".format(i + 1))
+				continue
 			
 			self.grid[by][bx] = tiles['boss']
 			# fill 3x3 square required by this boss with P1 tokens. This ensures
 			# the next spawnBosses and similar will not occupy one of these cells.
 			# These placeholders will be converted to BLANK during post-processing.
-			for i in range(by, by+3):
-				for j in range(bx, bx+3):
-					if i == by and j == bx: continue
-					self.grid[i][j] = tiles['player1']
+			for x, y in BOOMLevel.bossFootprint(bx, by)[1:]:
+				self.grid[y][x] = tiles['player1']
 
 			positions.append((bx, by))
 
@@ -495,23 +993,22 @@ class BOOMLevel:
 		return regions
 
 	def printLevelGrid(self, coloredRegions=False):
+		if quiet:
+			return
 		regions = self.findRegions()
 		for i in range(BOOMLevel.HEIGHT):
+			row = []
 			for j in range(BOOMLevel.WIDTH):
 				g = self.grid[i][j]
-				k = [k for k, v in tiles.items() if v == g or any(e in g for e in v)][0]
+				k = tilenames[g]
 				if k in tilecolors:
-					log_err("{}{}{}".format(color(k), g, nocol), end=' ')
+					row.append("{}{}{}".format(color(k), g, nocol))
 				elif coloredRegions:
-					for r in range(len(regions)):
-						if regions[r].contains(j, i):
-							log_err("{}{}{}".format(color(31+r), g, nocol), end=' ')
-							break
-					else:
-						log_err(self.grid[i][j], end=' ')
+					r = next((r for r in range(len(regions)) if regions[r].contains(j, i)), None)
+					row.append(g if r is None else "{}{}{}".format(color(31+r), g, nocol))
 				else:
-					log_err(self.grid[i][j], end=' ')
-			log_err(nocol)
+					row.append(g)
+			log_err(' '.join(row) + ' ' + nocol)
 	
 	# given a region, cycles on the blocks surrounding its external boundaries and
 	# changes the first fixed block it finds to a breakable one.
@@ -610,26 +1107,34 @@ class BOOMLevel:
 		# probability is higher for central squares.
 		#probx = lambda n: (1/64. * min(n+1, BOOMLevel.WIDTH-n) - 1/64.) * 1./(1 - BOOMLevel.WIDTH./64.)
 		#proby = lambda n: 1/49. * min(n+1, BOOMLevel.HEIGHT-n)
-		probx = lambda n: 1./BOOMLevel.HEIGHT * (0 if n == 0 or n == BOOMLevel.WIDTH else 1)
+		probx = lambda n: 1./(BOOMLevel.WIDTH - 2) * (0 if n == 0 or n == BOOMLevel.WIDTH - 1 else 1)
 		proby = lambda n: 1./BOOMLevel.HEIGHT
 		
 		def runWalker(probx, proby):
 			x = y = -1
+			tries = 0
 			while x == -1 or y == -1 or self.grid[y][x] in (tiles['player1'], tiles['player2']):
+				if self.budget.exhausted('runWalker', tries):
+					raise OutOfBudget()
+				tries += 1
 				rand = random()
 				for i in range(BOOMLevel.WIDTH):
 					if rand <= sum(probx(m) for m in range(i+1)):
 						x = i
 						break
 				else:
-					raise Exception("x was not set!")
+					# the sums may fall short of 1 by a rounding error
+					x = BOOMLevel.WIDTH - 2
 
 				for i in range(BOOMLevel.HEIGHT):
 					if rand <= sum(proby(m) for m in range(i+1)):
 						y = i
 						break
 				else:
-					raise Exception("y was not set!")
+					y = BOOMLevel.HEIGHT - 1
+
+				if self.domain is not None and not self.domain.contains(x, y):
+					x, y = self.symmetrize(x, y, self.symmetry)
 				
 				log_err("x = {}, y = {}".format(x, y))
 
@@ -637,14 +1142,20 @@ class BOOMLevel:
 			# initial direction towards the opposite direction as the border.
 			chuck = Walker(self, x, y)
 			while chuck.routine():
-				pass
+				# walks end by themselves within a few dozen steps: only the time counts
+				if self.budget.exhausted('walker'):
+					raise OutOfBudget()
 
 		# populate grid with walls
 		for _ in range(10):
 			runWalker(probx, proby)
 	
 	def genWallsRegularGrid(self):
-		if self.symmetry == SYM_CENTRAL:
+		if self.domain is not None:
+			for x, y in self.domain.cells:
+				if x % 2 == 1 and y % 2 == 1 and self.grid[y][x] == tiles['blank']:
+					self.grid[y][x] = tiles['fixed']
+		elif self.symmetry == SYM_CENTRAL:
 			for i in range(1, BOOMLevel.HEIGHT // 2, 2):
 				for j in range(1, BOOMLevel.WIDTH // 2, 2):
 					if self.grid[i][j] == tiles['blank']:
@@ -664,6 +1175,11 @@ class BOOMLevel:
 	def genWallsRandom(self, density = None):
 		if density == None:
 			density = 1/BOOMLevel.HEIGHT // 2.
+		if self.domain is not None:
+			for x, y in self.domain.cells:
+				if self.grid[y][x] == tiles['blank'] and random() < density:
+					self.grid[y][x] = tiles['fixed']
+			return
 		ranges = self.getRangesBasedOnSym(self.symmetry)
 		for i in ranges[0]:
 			for j in ranges[1]:
@@ -689,6 +1205,16 @@ class BOOMLevel:
 			log_err("[generate()] unknown: {}".format(what))
 			return
 
+		if self.domain is not None:
+			for x, y in self.domain.cells:
+				if random() >= prob:
+					continue
+				if what == 'enemies':
+					block = self.spawnEnemy()
+				if self.grid[y][x] == tiles['blank']:
+					self.grid[y][x] = block
+			return
+
 		ranges = self.getRangesBasedOnSym(self.symmetry)
 		for i in ranges[0]:
 			for j in ranges[1]:
@@ -703,6 +1229,17 @@ class BOOMLevel:
 					if self.grid[ii][jj] == tiles['blank']:
 						self.grid[ii][jj] = block
 
+	def pickWall(self, neigh):
+		'Returns the index of a random fixed wall among the `neigh`bours of a cell'
+		k = randint(0, 3)
+		tries = 0
+		while neigh[k] != 1:
+			tries += 1
+			if self.budget.exhausted('checkUnreachable', tries):
+				return neigh.index(1)
+			k = randint(0, 3)
+		return k
+
 	def checkUnreachable(self):
 		for i in range(BOOMLevel.HEIGHT):
 			for j in range(BOOMLevel.WIDTH):
@@ -712,9 +1249,7 @@ class BOOMLevel:
 				if not 0 in neigh:
 					log_err("spot x, y = {}, {} is unreachable!".format(j, i))
 					self.printLevelGrid()
-					k = randint(0, 3)
-					while neigh[k] != 1:
-						k = randint(0, 3)
+					k = self.pickWall(neigh)
 					if k == 0:
 						self.grid[i+1][j] = tiles['breakable']
 					elif k == 1:
@@ -727,7 +1262,16 @@ class BOOMLevel:
 					self.printLevelGrid()
 
 
-	def genGridDescString(self):
+	def decided(self, step):
+		'''Called once the `step` of DECISIONS is done: raises Rejected if the
+		accept callback doesn't want the level, so that searches can drop it
+		without generating the rest.'''
+		if self.accept is not None and not self.accept(self, step):
+			raise Rejected(step)
+
+	def genLayout(self):
+		'''First phase of genGridDescString: chooses the symmetry, spawns players
+		and bosses, places teleports and builds the (connected) walls.'''
 		# choose a symmetry
 		rand = random()
 		if rand > 0.75:
@@ -738,15 +1282,23 @@ class BOOMLevel:
 			self.symmetry = SYM_CENTRAL
 		else:
 			self.symmetry = SYM_NONE
+		self.decided('symmetry')
+
+		if self.bank is not None and self.level % 10 != 0 and self.bank.pick(self):
+			return
+
+		if self.fundamental and self.symmetry != SYM_NONE and self.level % 10 != 0:
+			self.genLayoutFundamental()
+			return
 
 		# spawn players
 		self.spawnPlayers()
 		
 		# spawn bosses if necessary
-		posBosses = None
+		self.posBosses = None
 		if self.level % 10 == 0:
-			posBosses = self.spawnBosses(self.level // 10)
-			log_err("posBosses = {}".format(posBosses))
+			self.posBosses = self.spawnBosses(self.level // 10)
+			log_err("posBosses = {}".format(self.posBosses))
 
 		# populate grid with teleports (at least 2 if any)
 		rand = random()
@@ -760,37 +1312,76 @@ class BOOMLevel:
 					break
 
 		# TODO: use level symmetry
+		placed = []
 		for i in range(numTeleport):
 			x = randint(0, BOOMLevel.WIDTH - 1)
 			y = randint(0, BOOMLevel.HEIGHT - 1)
-			while self.grid[y][x] != tiles['blank']:
+			tries = 1
+			while self.grid[y][x] != tiles['blank'] and not self.budget.exhausted('teleports', tries):
+				tries += 1
 				x = randint(0, BOOMLevel.WIDTH - 1)
 				y = randint(0, BOOMLevel.HEIGHT - 1)
+			if self.grid[y][x] != tiles['blank']:
+				break
 			self.grid[y][x] = tiles['teleport']
+			placed.append((x, y))
+		if len(placed) == 1:
+			# a lone teleport leads nowhere
+			x, y = placed[0]
+			self.grid[y][x] = tiles['blank']
+		self.decided('teleports')
 
 
 		# generate walls with a randomly choosen algorithm
-		rand = random()
-		if rand > 0.4:
-			self.wallsAlg = 'walkers'
-			self.genWallsWithWalkers()
-		elif rand > 0.1:
-			self.wallsAlg = 'regular'
-			self.genWallsRegularGrid()
-		else:
-			self.wallsAlg = 'random'
-			self.genWallsRandom()
+		self.genWalls()
 
 		log_err("Chosen symmetry: {}".format(self.symmetry))
 		log_err("Chosen algorithm: {}".format(self.wallsAlg))
 		
 		# ensure all spots are reachable
 		regions = self.findRegions()
+		self.regionsBeforeRepair = len(regions)
+		rounds = 0
 		while len(regions) > 1:
+			rounds += 1
+			if self.budget.exhausted('connectRegions', rounds):
+				self.fallbackWalls()
+				break
 			for region in regions:
 				self.openBoundaries(region)
 			regions = self.findRegions()
 
+	def genWalls(self):
+		'Generates walls with a randomly choosen algorithm'
+		rand = random()
+		self.wallsAlg = 'walkers' if rand > 0.4 else 'regular' if rand > 0.1 else 'random'
+		self.decided('wallsAlg')
+		if self.wallsAlg == 'walkers':
+			try:
+				self.genWallsWithWalkers()
+			except OutOfBudget:
+				self.fallbackWalls()
+		elif self.wallsAlg == 'regular':
+			self.genWallsRegularGrid()
+		else:
+			self.genWallsRandom()
+
+	def fallbackWalls(self):
+		'''Replaces all the walls generated so far with a regular grid, which
+		is cheap and always connected.'''
+		for row in self.grid:
+			for x, tile in enumerate(row):
+				if tile in (tiles['fixed'], tiles['breakable']):
+					row[x] = tiles['blank']
+		self.wallsAlg = 'regular'
+		self.genWallsRegularGrid()
+
+	def populate(self):
+		'''Second phase of genGridDescString: fills the layout built by genLayout
+		with enemies, coins and breakable walls. Returns the grid string.'''
+		if self.domain is not None:
+			return self.populateFundamental()
+
 		# populate grid with enemies
 		self.generate('enemies')
 
@@ -802,13 +1393,10 @@ class BOOMLevel:
 
 		# POST PROCESSING: ensure level is resolvable
 		# if bosses were generated, replace placeholder p1 tokens with 0's
-		if posBosses:
-			for bx, by in posBosses:
-				for i in range(by, by+3):
-					for j in range(bx, bx+3):
-						if i == by and j == bx: continue
-						else:
-							self.grid[i][j] = tiles['blank']
+		if self.posBosses:
+			for bx, by in self.posBosses:
+				for x, y in BOOMLevel.bossFootprint(bx, by)[1:]:
+					self.grid[y][x] = tiles['blank']
 			
 		# recheck that both players exist.
 		p1found = p2found = False
@@ -839,80 +1427,276 @@ class BOOMLevel:
 		string = ''.join(self.grid[i][j] for i in range(BOOMLevel.HEIGHT) for j in range(BOOMLevel.WIDTH))
 		return string
 		
-	def genLastLevel(self, lifish = False):
-		string = ''
-		# put p1 in first line
-		rand = randint(0, BOOMLevel.WIDTH)
-		string += ''.join(tiles['blank'] for i in range(rand)) + tiles['player1'] + \
-				''.join(tiles['blank'] for i in range(rand+1, BOOMLevel.WIDTH))
-		# line 1 is a wall separating the Big Alien Boss from p1
-		chooseWall = lambda x: tiles['fixed'] if random() < x else tiles['breakable']
-		string += tiles['breakable']*2 + ''.join(chooseWall(0.2) for i in range(BOOMLevel.WIDTH - 4)) + tiles['breakable']*2
-		# lines 2-10 are 'reserved' for containing the Boss, so we only generate side walls
-		# line 2 is fixed
-		string += tiles['blank'] + tiles['breakable'] + tiles['blank']*11 + tiles['breakable'] + tiles['blank']
-		# choose line where to spawn boss
-		bossline = randint(4, 7)
-		bosstile = tiles['boss'] if not lifish else tiles['lifish_lastboss']
-		for i in range(3, 10):
-			middle = tiles['blank']*11 if i != bossline else tiles['blank']*4 + bosstile + tiles['blank']*6
-			string += (tiles['blank'] if random() < 0.6 else chooseWall(0.3)) + chooseWall(0.3) + \
-				middle + chooseWall(0.3) + (tiles['blank'] if random() < 0.6 else chooseWall(0.3))
-		# now, mirror 
-		string += tiles['blank'] + tiles['breakable'] + tiles['blank']*(BOOMLevel.WIDTH - 4) + tiles['breakable'] + tiles['blank']
-		string += tiles['breakable']*2 + ''.join([chooseWall(0.2) for i in range(11)]) + tiles['breakable']*2
-		rand = randint(0, BOOMLevel.WIDTH)
-		string += ''.join(tiles['blank'] for i in range(rand)) + tiles['player2'] + \
-				''.join(tiles['blank'] for i in range(rand+1, BOOMLevel.WIDTH))
+	def genLayoutFundamental(self):
+		'''Like genLayout, but only generates the fundamental domain of the
+		chosen symmetry. The other half of the grid is left blank until
+		populateFundamental mirrors the domain over it.'''
+		self.domain = domain = Domain.get(self.symmetry)
+
+		# spawn player 1: player 2 will be its mirror
+		px, py = sample([c for n, c in enumerate(domain.cells) if not domain.selfMirror[n]], 1)[0]
+		self.grid[py][px] = tiles['player1']
+		log_err("Spawned player 1 in x, y = {}, {}".format(px, py))
+
+		# teleports: each one placed outside the symmetry axis counts twice
+		rand = random()
+		numTeleport = 0
+		if rand > 0.333:
+			rand = random()
+			p = lambda n: .118519 * (19/16. - 3*n/32.)
+			for i in range(2, 10):
+				if rand <= sum(p(n) for n in range(2, i+1)):
+					numTeleport = i
+					break
+		blanks = [n for n, (x, y) in enumerate(domain.cells) if self.grid[y][x] == tiles['blank']]
+		placed = 0
+		while placed < numTeleport and blanks:
+			n = blanks.pop(randint(0, len(blanks) - 1))
+			x, y = domain.cells[n]
+			self.grid[y][x] = tiles['teleport']
+			placed += 1 if domain.selfMirror[n] else 2
+		self.decided('teleports')
+
+		self.genWalls()
+
+		log_err("Chosen symmetry: {}".format(self.symmetry))
+		log_err("Chosen algorithm: {}".format(self.wallsAlg))
+
+		regions = domain.liftedRegions(self.grid)
+		self.regionsBeforeRepair = len(regions)
+		rounds = 0
+		while len(regions) > 1:
+			rounds += 1
+			if self.budget.exhausted('connectRegions', rounds):
+				self.fallbackWalls()
+				break
+			for x, y in domain.wallsPath(self.grid, regions[0]):
+				self.grid[y][x] = tiles['breakable']
+			regions = domain.liftedRegions(self.grid)
+
+	def populateFundamental(self):
+		'''Populates the domain generated by genLayoutFundamental, then mirrors
+		it over the whole grid. Returns the grid string.'''
+		self.generate('enemies')
+		self.generate('coins')
+		self.generate('breakable')
+		self.mirrorDomain()
+
+		p1Coords = next((x, y) for x, y in self.domain.cells if self.grid[y][x] == tiles['player1'])
+		p2Coords = self.symmetrize(p1Coords[0], p1Coords[1], self.symmetry)
+		# securing a player only removes a few enemies: do the same on the
+		# other side, so that the level stays symmetric.
+		for coords in (p1Coords, p2Coords):
+			before = [row[:] for row in self.grid]
+			self.securePlayer(coords)
+			for y in range(BOOMLevel.HEIGHT):
+				for x in range(BOOMLevel.WIDTH):
+					if self.grid[y][x] != before[y][x]:
+						sx, sy = self.symmetrize(x, y, self.symmetry)
+						self.grid[sy][sx] = self.grid[y][x]
+
+		self.checkUnreachable()
+		return ''.join(self.grid[i][j] for i in range(BOOMLevel.HEIGHT) for j in range(BOOMLevel.WIDTH))
+
+	def mirrorDomain(self):
+		'Copies every domain cell onto its mirror, turning player 1 into player 2'
+		grid = self.grid
+		for (x, y), (sx, sy) in zip(self.domain.cells, self.domain.mirror):
+			tile = grid[y][x]
+			grid[sy][sx] = tiles['player2'] if tile == tiles['player1'] and (sx, sy) != (x, y) else tile
+
+	def genGridDescString(self):
+		self.genLayout()
+		self.decided('layout')
+		return self.populate()
+
+	def genStage(self, name, bossTile = tiles['boss'], numBosses = 0):
+		'''Generates the special stage `name` of STAGE_TEMPLATES, with at least
+		`numBosses` bosses. Returns the grid string.'''
+		plan = StagePlan.get(name, BOOMLevel.WIDTH, BOOMLevel.HEIGHT)
+		string, self.posBosses = plan.fill(bossTile)
+		if numBosses > len(self.posBosses):
+			string = self.addStageBosses(plan, string, numBosses - len(self.posBosses), bossTile)
 		# fill out grid for log's sake
-		for i in range(BOOMLevel.HEIGHT):
-			for j in range(BOOMLevel.WIDTH):
-				self.grid[i][j] = string[i*BOOMLevel.WIDTH+j]
+		for i, row in enumerate(self.grid):
+			row[:] = string[i*BOOMLevel.WIDTH:(i+1)*BOOMLevel.WIDTH]
 		return string
 
-	def genLevel(self):
+	def addStageBosses(self, plan, string, numBosses, bossTile):
+		'Puts `numBosses` more bosses in random free spots of a stage'
+		cells = list(string)
+		taken = set(c for bx, by in self.posBosses for c in BOOMLevel.bossFootprint(bx, by))
+		# anywhere but on the rows of the players
+		rows = set(start // BOOMLevel.WIDTH for _, start in plan.spawns)
+		spots = [(x, y) for y in range(BOOMLevel.HEIGHT - 2) if rows.isdisjoint(range(y, y + 3))
+				for x in range(BOOMLevel.WIDTH - 2)]
+		for _ in range(numBosses):
+			free = [(x, y) for x, y in spots if taken.isdisjoint(BOOMLevel.bossFootprint(x, y))]
+			if not free:
+				log_err("No room for boss {}".format(len(self.posBosses) + 1))
+				break
+			bx, by = free[randint(0, len(free) - 1)]
+			for x, y in BOOMLevel.bossFootprint(bx, by):
+				cells[y * BOOMLevel.WIDTH + x] = tiles['blank']
+				taken.add((x, y))
+			cells[by * BOOMLevel.WIDTH + bx] = bossTile
+			self.posBosses.append((bx, by))
+		return ''.join(cells)
+
+	def genLastLevel(self, lifish = False):
+		return self.genStage('classic', tiles['lifish_lastboss'] if lifish else tiles['boss'])
+
+	def genGrid(self, lifish = False):
+		'Chooses the level parameters and generates its grid string'
+		self.budget.start()
 		self.setParameters()
-		print("  <dict>")
-		print("   <key>BGPatternID</key>")
-		print("   <integer>{}</integer>".format(self.bgPatternID))
-		print("   <key>BorderID</key>")
-		print("   <integer>{}</integer>".format(self.borderID))
-		print("   <key>BreakableBlockID</key>")
-		print("   <integer>{}</integer>".format(self.breakableBlockID))
-		print("   <key>FixedBlockID</key>")
-		print("   <integer>{}</integer>".format(self.fixedBlockID))
-		print("   <key>GridDescString</key>")
-		print("   <string>{}</string>".format(self.genLastLevel() if self.level == N_LEVELS else self.genGridDescString()))
-		print("   <key>Time</key>")
-		print("   <integer>{}</integer>".format(self.time))
-		print("  </dict>")
+		if self.level == N_LEVELS:
+			self.gridString = self.genLastLevel(lifish=lifish)
+		elif self.bossStages and self.level % 10 == 0:
+			names = sorted(STAGE_TEMPLATES)
+			self.gridString = self.genStage(names[randint(0, len(names) - 1)], numBosses = self.level // 10)
+		else:
+			self.gridString = self.genGridDescString()
+		return self.gridString
+
+	def plistEntry(self):
+		return PLIST_LEVEL % (self.bgPatternID, self.borderID, self.breakableBlockID,
+				self.fixedBlockID, self.gridString, self.time)
+
+	def plistDict(self):
+		return {
+			'BGPatternID': self.bgPatternID,
+			'BorderID': self.borderID,
+			'BreakableBlockID': self.breakableBlockID,
+			'FixedBlockID': self.fixedBlockID,
+			'GridDescString': self.gridString,
+			'Time': self.time,
+		}
+
+	def lifishEntry(self, last = False):
+		'The Lifish entry of the level: `last` is whether it ends the pack (no comma after it)'
+		return LIFISH_LEVEL % (self.time, self.level, min(8, self.level // 10 + 1),
+				BOOMLevel.WIDTH, BOOMLevel.HEIGHT, self.bgPatternID, self.borderID + 1,
+				self.fixedBlockID + 1, self.breakableBlockID // 4 + 1, self.gridString,
+				',\n\t\t\t"nav": ' + json.dumps(self.nav, separators=(',', ':')) if self.nav else '',
+				'' if last else ',')
+
+	def lifishDict(self):
+		d = {
+			'time': self.time,
+			'num': self.level,
+			'music': min(8, self.level // 10 + 1),
+			'width': BOOMLevel.WIDTH,
+			'height': BOOMLevel.HEIGHT,
+			'tileIDs': {
+				'bg': self.bgPatternID,
+				'border': self.borderID + 1,
+				'fixed': self.fixedBlockID + 1,
+				'breakable': self.breakableBlockID // 4 + 1,
+			},
+			'tilemap': self.gridString,
+			'effects': [],
+		}
+		if self.nav:
+			d['nav'] = self.nav
+		return d
+
+	def navigation(self):
+		"""Computes the navigation data of the final grid, for the game AI:
+		  "walkable": the bitmap of the cells which are walkable once the
+		      breakable walls are gone (i.e. no fixed walls nor boss
+		      footprints, see bossFootprint), packed
+		      row-major 8 cells per byte, first cell in the highest bit, as hex
+		  "distances": for each player spawn, the BFS distance of every cell
+		      from it over those cells (row-major, -1 if unreachable), which is
+		      a lower bound of the actual one, e.g. for A*. Teleports count as
+		      linked to each other, at the cost of one step.
+		  "teleports": the [x, y] of each teleport
+		  "teleportLinks": the pairs of indices of linked teleports
+		Sets and returns self.nav."""
+		width, height = BOOMLevel.WIDTH, BOOMLevel.HEIGHT
+		cells = self.gridString[:width * height]
+		walkable = [c != tiles['fixed'] for c in cells]
+		for i, c in enumerate(cells):
+			if c in (tiles['boss'], tiles['lifish_lastboss']):
+				for x, y in BOOMLevel.bossFootprint(i % width, i // width):
+					if x < width and y < height:
+						walkable[y * width + x] = False
+		teleports = [i for i, c in enumerate(cells) if c == tiles['teleport']]
+
+		def distances(start):
+			dist = [-1] * len(cells)
+			dist[start] = 0
+			queue = deque([start])
+			while queue:
+				i = queue.popleft()
+				x = i % width
+				neigh = []
+				if x > 0: neigh.append(i - 1)
+				if x < width - 1: neigh.append(i + 1)
+				if i >= width: neigh.append(i - width)
+				if i + width < len(cells): neigh.append(i + width)
+				if cells[i] == tiles['teleport']:
+					neigh += teleports
+				for j in neigh:
+					if dist[j] < 0 and walkable[j]:
+						dist[j] = dist[i] + 1
+						queue.append(j)
+			return dist
+
+		bitmap = 0
+		for w in walkable:
+			bitmap = bitmap << 1 | w
+		nbytes = (len(cells) + 7) // 8
+		bitmap <<= nbytes * 8 - len(cells)
+		self.nav = {
+			'walkable': bitmap.to_bytes(nbytes, 'big').hex(),
+			'distances': {name: distances(cells.index(tiles[name]))
+					for name in ('player1', 'player2') if tiles[name] in cells},
+			'teleports': [[i % width, i // width] for i in teleports],
+			'teleportLinks': [[a, b] for a in range(len(teleports)) for b in range(a + 1, len(teleports))],
+		}
+		return self.nav
+
+	def genLevel(self):
+		self.genGrid()
+		stdout.write(self.plistEntry())
 
 	def genLevelLifish(self):
-		self.setParameters()
-		print("""\t\t{""")
-		print("""\t\t\t"time": {},""".format(self.time))
-		print("""\t\t\t"num": {},""".format(self.level))
-		print("""\t\t\t"music": {},""".format(min(8, self.level // 10 + 1)))
-		print("""\t\t\t"width": {},""".format(BOOMLevel.WIDTH))
-		print("""\t\t\t"height": {},""".format(BOOMLevel.HEIGHT))
-		print("""\t\t\t"tileIDs": {""")
-		print("""\t\t\t\t"bg": {},""".format(self.bgPatternID))
-		print("""\t\t\t\t"border": {},""".format(self.borderID + 1))
-		print("""\t\t\t\t"fixed": {},""".format(self.fixedBlockID + 1))
-		print("""\t\t\t\t"breakable": {}""".format(self.breakableBlockID // 4 + 1))
-		print("""\t\t\t},""")
-		print("""\t\t\t"tilemap": "{}",""".format(self.genLastLevel(lifish=True) if self.level == N_LEVELS else self.genGridDescString()))
-		print("""\t\t\t"effects": []""")
-		print("""\t\t}""" + (',' if self.level < N_LEVELS else ''))
+		self.genGrid(lifish=True)
+		stdout.write(self.lifishEntry(last = self.level == N_LEVELS))
+
+
+class LevelSnapshot:
+	"""The result of a generation, copied out of a BOOMLevel so that the
+	generator can be reset for the next level: what the writers and the
+	checks run on the finished pack need, with the same methods."""
+	__slots__ = ('level', 'bgPatternID', 'borderID', 'breakableBlockID', 'fixedBlockID', 'time',
+			'gridString', 'nav', 'budget')
+
+	def __init__(self, level):
+		for name in LevelSnapshot.__slots__:
+			setattr(self, name, getattr(level, name))
+
+	plistEntry = BOOMLevel.plistEntry
+	plistDict = BOOMLevel.plistDict
+	lifishEntry = BOOMLevel.lifishEntry
+	lifishDict = BOOMLevel.lifishDict
+	navigation = BOOMLevel.navigation
+
 
 class Walker:
+	# directions and turns
+	up, right, down, left = 0, 1, 2, 3
+	cw, ccw = 1, -1
+
+	__slots__ = ('level', 'x', 'y', 'direction', 'lastTurn', 'nTurn', 'nStep')
+
 	def __init__(self, level, x, y):
 		self.level = level
 		self.x = x
 		self.y = y
-		self.up, self.right, self.down, self.left = 0, 1, 2, 3
 		self.direction = self.chooseStartingDirection()
-		self.cw, self.ccw = 1, -1
 		self.lastTurn = self.cw
 		self.nTurn = 1000
 		self.nStep = 0
@@ -965,7 +1749,8 @@ class Walker:
 					elif rand == 2: return self.up
 					elif rand < BOOMLevel.HEIGHT - 1: return self.down
 					else: return self.left
-			else: return randint(0, 3)
+			# away from the corners any direction will do
+			return randint(0, 3)
 	
 	def nextBlock(self, direction):
 		if direction == self.up: 
@@ -983,6 +1768,9 @@ class Walker:
 		x, y = self.nextBlock(self.direction)
 		return self.level.grid[y][x] == tiles['blank'] 
 	
+	def nextInDomain(self):
+		return self.level.domain is None or self.level.domain.contains(*self.nextBlock(self.direction))
+
 	def onBorder(self):
 		return self.x == 0 or self.x == BOOMLevel.WIDTH - 1 or self.y == 0 or self.y == BOOMLevel.HEIGHT - 1
 
@@ -1032,6 +1820,9 @@ class Walker:
 	
 	def placeBlockWithSym(self, x, y, block, filterset):
 		self.level.grid[y][x] = block
+		if self.level.domain is not None:
+			# mirrored at the end of the generation
+			return
 
 		symx = BOOMLevel.WIDTH - 1 - x
 		symy = BOOMLevel.HEIGHT - 1 - y
@@ -1049,39 +1840,45 @@ class Walker:
 		if self.nStep > 0:
 			self.direction = self.chooseDirection()
 
-		if not self.onBorder() and (self.nextIsBlank() or self.walkOn()):
+		if not self.onBorder() and self.nextInDomain() and (self.nextIsBlank() or self.walkOn()):
 			self.move()
 			return True
 		else:
 			self.endWalk()
+			self.level.walkerSteps.append(self.nStep)
 			log_err("Walker made {} steps.".format(self.nStep))
 			return False
 			
 
 class Region:
+	# `cells` holds the same cells as `pairs`, for constant time lookups
+	__slots__ = ('pairs', 'cells')
+
 	def __init__(self):
 		self.pairs = []
+		self.cells = set()
 
 	def add(self, x, y):
 		self.pairs.append((x, y))
+		self.cells.add((x, y))
 
 	def contains(self, x, y):
-		return (x, y) in self.pairs
+		return (x, y) in self.cells
 
 	def isContiguous(self, x, y):
-		return any(
-			(x == i and (y == j-1 or y == j+1)) or
-			(y == j and (x == i-1 or x == i+1))
-			for i, j in self.pairs)
+		cells = self.cells
+		return (x, y-1) in cells or (x, y+1) in cells or (x-1, y) in cells or (x+1, y) in cells
 	
 	def connectedWith(self, region):
 		return any(self.isContiguous(i, j) for i, j in region.pairs)
 	
 	def mergeWith(self, region):
 		self.pairs = list(set(self.pairs + region.pairs))
+		self.cells = set(self.pairs)
 	
 	def clear(self):
 		self.pairs = []
+		self.cells = set()
 	
 	def isEmpty(self):
 		return len(self.pairs) == 0
@@ -1099,6 +1896,413 @@ class Region:
 		return max(0, max(self.pairs, key=lambda p: p[1])[1])
 
 
+class Bitboard:
+	"""Precomputed masks to handle a whole grid layer as a single int, where
+	bit y * WIDTH + x stands for cell (x, y)."""
+	_cache = {}
+
+	@staticmethod
+	def get():
+		key = (BOOMLevel.WIDTH, BOOMLevel.HEIGHT)
+		if key not in Bitboard._cache:
+			Bitboard._cache[key] = Bitboard(*key)
+		return Bitboard._cache[key]
+
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.ncells = width * height
+		self.full = (1 << self.ncells) - 1
+		self.cols = [sum(1 << (y * width + x) for y in range(height)) for x in range(width)]
+		self.notFirstCol = self.full & ~self.cols[0]
+		self.notLastCol = self.full & ~self.cols[-1]
+		# mask of the 4-neighbours of each cell
+		self.neigh = [self.adjacent(1 << n) for n in range(self.ncells)]
+		# maps a tile char to '1' if it's in the layer, '0' otherwise
+		self.tables = {}
+
+	def layer(self, grid, chars):
+		"""Returns the bitboard of the cells of `grid` (list of rows) holding
+		one of `chars`."""
+		table = self.tables.get(chars)
+		if table is None:
+			table = self.tables[chars] = str.maketrans(
+				{chr(c): '1' if chr(c) in chars else '0' for c in range(128)})
+		# int() wants the most significant bit first, i.e. the last cell
+		return int(''.join([''.join(row) for row in grid]).translate(table)[::-1], 2)
+
+	def adjacent(self, mask):
+		'Returns the cells adjacent to any cell of `mask`'
+		return ((mask >> self.width) | (mask << self.width)
+			| ((mask << 1) & self.notFirstCol) | ((mask >> 1) & self.notLastCol)) & self.full
+
+	def expand(self, mask):
+		'Returns `mask` plus all the cells adjacent to it'
+		return mask | self.adjacent(mask)
+
+
+class BitRegion:
+	'A Region stored as a bitboard'
+	__slots__ = ('board', 'mask')
+
+	def __init__(self, board, mask):
+		self.board = board
+		self.mask = mask
+
+	def contains(self, x, y):
+		return self.mask >> (y * self.board.width + x) & 1 == 1
+
+	def isEmpty(self):
+		return self.mask == 0
+
+	def leftmost(self):
+		return next(x for x, col in enumerate(self.board.cols) if self.mask & col)
+
+	def rightmost(self):
+		return next(x for x in reversed(range(self.board.width)) if self.mask & self.board.cols[x])
+
+	def upmost(self):
+		return ((self.mask & -self.mask).bit_length() - 1) // self.board.width
+
+	def downmost(self):
+		return (self.mask.bit_length() - 1) // self.board.width
+
+
+class BitboardLevel(BOOMLevel):
+	"""BOOMLevel whose connectivity checks (findRegions and checkUnreachable)
+	work on a bitboard of the fixed walls; everything else runs on the grid
+	of BOOMLevel. Given the same random state it generates exactly the same
+	levels as BOOMLevel."""
+	__slots__ = ()
+
+	def findRegions(self):
+		# Same scan-and-merge as BOOMLevel.findRegions (including which regions
+		# end up merged), but each contiguity test is a single mask operation.
+		board = Bitboard.get()
+		free = board.full & ~board.layer(self.grid, tiles['fixed'])
+		neigh = board.neigh
+		tmpregions = []
+		rest = free
+		while rest:
+			bit = rest & -rest
+			rest ^= bit
+			n = bit.bit_length() - 1
+			for k, mask in enumerate(tmpregions):
+				if mask & neigh[n]:
+					tmpregions[k] = mask | bit
+					break
+			else:
+				tmpregions.append(bit)
+
+		for i in range(len(tmpregions)):
+			for j in range(i + 1, len(tmpregions)):
+				if tmpregions[j] and board.expand(tmpregions[i]) & tmpregions[j]:
+					tmpregions[i] |= tmpregions[j]
+					tmpregions[j] = 0
+
+		regions = [BitRegion(board, mask) for mask in tmpregions if mask]
+		log_err("[findRegion] found {} regions.".format(len(regions)))
+		return regions
+
+	def checkUnreachable(self):
+		board = Bitboard.get()
+		free = board.full & ~board.layer(self.grid, tiles['fixed'])
+		n = 0
+		while True:
+			# free cells (from the n-th on) with no free neighbour
+			isolated = (free & ~board.adjacent(free)) >> n
+			if not isolated:
+				break
+			n += (isolated & -isolated).bit_length() - 1
+			i, j = divmod(n, BOOMLevel.WIDTH)
+			neigh = self.neighbours(i, j)
+			log_err("spot x, y = {}, {} is unreachable!".format(j, i))
+			self.printLevelGrid()
+			k = self.pickWall(neigh)
+			y, x = ((i+1, j), (i, j+1), (i-1, j), (i, j-1))[k]
+			self.grid[y][x] = tiles['breakable']
+			free |= 1 << (y * BOOMLevel.WIDTH + x)
+			log_err("Fixed:\n")
+			self.printLevelGrid()
+			n += 1
+
+
+class Domain:
+	"""Fundamental domain of a symmetry, i.e. the cells whose row-major index
+	is not greater than the one of their mirror. A symmetric grid is fully
+	determined by the content of these cells.
+
+	Connectivity is checked on the quotient graph: domain cells are linked
+	if they, or their mirrors, are adjacent in the full grid. Each link also
+	tells whether it crosses the symmetry axis, so walking the quotient while
+	tracking which side of the axis we're on (the "parity") explores exactly
+	the full grid, while only touching the domain cells."""
+	_cache = {}
+
+	@staticmethod
+	def get(sym):
+		key = (BOOMLevel.WIDTH, BOOMLevel.HEIGHT, sym)
+		if key not in Domain._cache:
+			Domain._cache[key] = Domain(sym)
+		return Domain._cache[key]
+
+	def __init__(self, sym):
+		W, H = BOOMLevel.WIDTH, BOOMLevel.HEIGHT
+		self.sym = sym
+		self.cells = []
+		self.mirror = []
+		for y in range(H):
+			for x in range(W):
+				sx, sy = BOOMLevel.symmetrize(x, y, sym)
+				if y * W + x <= sy * W + sx:
+					self.cells.append((x, y))
+					self.mirror.append((sx, sy))
+		self.index = {c: n for n, c in enumerate(self.cells)}
+		self.selfMirror = [c == m for c, m in zip(self.cells, self.mirror)]
+		# for each cell, the list of its quotient neighbours as (index, crosses axis)
+		self.neigh = []
+		for x, y in self.cells:
+			neigh = []
+			for nx, ny in ((x, y-1), (x+1, y), (x, y+1), (x-1, y)):
+				if not (0 <= nx < W and 0 <= ny < H):
+					continue
+				if (nx, ny) in self.index:
+					neigh.append((self.index[(nx, ny)], False))
+				else:
+					neigh.append((self.index[BOOMLevel.symmetrize(nx, ny, sym)], True))
+			self.neigh.append(neigh)
+
+	def contains(self, x, y):
+		return (x, y) in self.index
+
+	def _step(self, state, n, crosses):
+		# a state is 2 * cell index + parity; cells on the axis have no parity
+		parity = (state & 1) ^ crosses
+		return 2 * n + (0 if self.selfMirror[n] else parity)
+
+	def liftedRegions(self, grid):
+		"""Returns the connected regions of non-fixed cells of the full grid,
+		each as a set of states (2 * cell index + parity)."""
+		fixed = tiles['fixed']
+		isOpen = [grid[y][x] != fixed for x, y in self.cells]
+		seen = set()
+		regions = []
+		for n in range(len(self.cells)):
+			if not isOpen[n]:
+				continue
+			for start in ((2 * n,) if self.selfMirror[n] else (2 * n, 2 * n + 1)):
+				if start in seen:
+					continue
+				region = {start}
+				stack = [start]
+				while stack:
+					s = stack.pop()
+					for m, crosses in self.neigh[s >> 1]:
+						t = self._step(s, m, crosses)
+						if isOpen[m] and t not in region:
+							region.add(t)
+							stack.append(t)
+				seen |= region
+				regions.append(region)
+		return regions
+
+	def wallsPath(self, grid, region):
+		"""Finds the shortest path from `region` to any other non-fixed cell
+		of the grid, counting only the fixed cells crossed (0-1 BFS).
+		Returns the domain cells of the fixed blocks along it."""
+		fixed = tiles['fixed']
+		isFixed = [grid[y][x] == fixed for x, y in self.cells]
+		cost = dict.fromkeys(region, 0)
+		prev = {}
+		queue = deque(region)
+		while queue:
+			s = queue.popleft()
+			for m, crosses in self.neigh[s >> 1]:
+				t = self._step(s, m, crosses)
+				c = cost[s] + isFixed[m]
+				if t in cost and cost[t] <= c:
+					continue
+				cost[t] = c
+				prev[t] = s
+				if not isFixed[m]:
+					# reached an open cell outside the region
+					path = []
+					while t not in region:
+						t = prev[t]
+						if isFixed[t >> 1]:
+							path.append(self.cells[t >> 1])
+					return path
+				queue.append(t)
+		return []
+
+
+class LevelPack:
+	"""An existing pack produced by this script (plist or Lifish), kept as
+	text so single levels can be swapped without touching the rest."""
+	PLIST_LEVEL_RE = re.compile(r'^(  |\t\t)<dict>\n.*?^\1</dict>\n', re.M | re.S)
+	LIFISH_LEVEL_RE = re.compile(r'^\t\t\{\n\t\t\t"time".*?^\t\t\}(,?)\n', re.M | re.S)
+	LIFISH_NUM_RE = re.compile(r'"num": (\d+)')
+	GRID_RE = re.compile(r'"tilemap": "([^"]*)"|<string>([^<]*)</string>')
+
+	def __init__(self, text):
+		self.text = text
+		self.lifish = text.lstrip().startswith('{')
+		# level number -> (start, end) of its entry in self.text
+		self.spans = {}
+		# level number -> separator following the entry (Lifish only)
+		self.separators = {}
+		if self.lifish:
+			for n, m in enumerate(LevelPack.LIFISH_LEVEL_RE.finditer(text)):
+				num = LevelPack.LIFISH_NUM_RE.search(m.group(0))
+				num = int(num.group(1)) if num else n + 1
+				self.spans[num] = m.span()
+				self.separators[num] = m.group(1)
+		else:
+			for n, m in enumerate(LevelPack.PLIST_LEVEL_RE.finditer(text)):
+				self.spans[n + 1] = m.span()
+		if not self.spans:
+			raise ValueError("no levels found in pack")
+
+	def entry(self, num):
+		start, end = self.spans[num]
+		return self.text[start:end]
+
+	def grid(self, num):
+		'Returns the grid string of level `num`'
+		m = LevelPack.GRID_RE.search(self.entry(num))
+		return m.group(1) if self.lifish else m.group(2)
+
+	def patch(self, entries):
+		"""Returns the pack text with the entries of the levels in `entries`
+		(a dict level number -> new entry text) replaced."""
+		out = []
+		pos = 0
+		for num in sorted(entries, key=lambda n: self.spans[n][0]):
+			start, end = self.spans[num]
+			entry = entries[num]
+			if self.lifish:
+				# keep the original separator, so that the JSON stays valid
+				# regardless of where the level sits in the pack.
+				entry = entry.rstrip().rstrip(',') + self.separators[num] + '\n'
+			out.append(self.text[pos:start])
+			out.append(entry)
+			pos = end
+		out.append(self.text[pos:])
+		return ''.join(out)
+
+
+class LayoutBank:
+	"""A sqlite file of validated layouts (the grids left by genLayout:
+	connected walls, players and teleports), by symmetry and walls algorithm,
+	built offline by boomlayoutbank.py. Layouts don't depend on the level
+	number, except for boss levels, which are never taken from the bank."""
+	def __init__(self, path, width = None, height = None):
+		self.width = width or BOOMLevel.WIDTH
+		self.height = height or BOOMLevel.HEIGHT
+		self.db = sqlite3.connect(path)
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS layouts (
+				symmetry INTEGER NOT NULL,
+				walls_alg TEXT NOT NULL,
+				n INTEGER NOT NULL,
+				grid TEXT UNIQUE NOT NULL,
+				regions INTEGER,
+				PRIMARY KEY (symmetry, walls_alg, n)
+			) WITHOUT ROWID;
+			CREATE TABLE IF NOT EXISTS meta (width INTEGER, height INTEGER);
+		''')
+		size = self.db.execute('SELECT width, height FROM meta').fetchone()
+		if size is None:
+			self.db.execute('INSERT INTO meta VALUES (?, ?)', (self.width, self.height))
+		elif size != (self.width, self.height):
+			raise ValueError("layout bank is for {}x{} grids".format(*size))
+		# (symmetry, wallsAlg) -> number of layouts, so that picking one is a
+		# single primary key lookup
+		self.counts = {(sym, alg): n for sym, alg, n in self.db.execute(
+				'SELECT symmetry, walls_alg, COUNT(*) FROM layouts GROUP BY symmetry, walls_alg')}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		self.db.commit()
+		self.db.close()
+
+	def __len__(self):
+		return sum(self.counts.values())
+
+	def add(self, symmetry, wallsAlg, grid, regions = None):
+		'Stores a layout grid string. Returns False if it was already there.'
+		key = (symmetry, wallsAlg)
+		cur = self.db.execute('INSERT OR IGNORE INTO layouts VALUES (?, ?, ?, ?, ?)',
+				(symmetry, wallsAlg, self.counts.get(key, 0), grid, regions))
+		if cur.rowcount == 0:
+			return False
+		self.counts[key] = self.counts.get(key, 0) + 1
+		return True
+
+	def pick(self, level):
+		"""Loads a random layout with the symmetry already chosen for `level`
+		into it, mirrored at random (which keeps any symmetry). The walls
+		algorithm is drawn as genWalls does. Returns False, leaving `level`
+		untouched, if the bank has no such layout."""
+		rand = random()
+		wallsAlg = 'walkers' if rand > 0.4 else 'regular' if rand > 0.1 else 'random'
+		count = self.counts.get((level.symmetry, wallsAlg), 0)
+		if count == 0:
+			return False
+		n = randint(0, count - 1)
+		grid, regions = self.db.execute(
+				'SELECT grid, regions FROM layouts WHERE symmetry = ? AND walls_alg = ? AND n = ?',
+				(level.symmetry, wallsAlg, n)).fetchone()
+		# copy it into the grid of the level, in place
+		rows = level.grid
+		for y, row in enumerate(rows):
+			row[:] = grid[y * self.width:(y + 1) * self.width]
+		flip = randint(0, 3)
+		if flip & 1:
+			rows.reverse()
+		if flip & 2:
+			for row in rows:
+				row.reverse()
+		level.wallsAlg = wallsAlg
+		level.regionsBeforeRepair = regions
+		level.posBosses = None
+		log_err("Picked layout {} of {} with symmetry {} and {} walls".format(
+			n, count, level.symmetry, wallsAlg))
+		return True
+
+
+def rebuildPack(text, reroll, engine = 'grid', seed = None, **levelOpts):
+	"""Regenerates only the levels numbered in `reroll` of the pack `text`,
+	keeping all the others verbatim. Returns the new pack text. With a
+	`seed`, each level is the same as in the pack generated with it."""
+	pack = LevelPack(text)
+	missing = set(reroll) - set(pack.spans)
+	if missing:
+		raise ValueError("pack has no level(s) {}".format(', '.join(map(str, sorted(missing)))))
+	entries = {}
+	for num in sorted(set(reroll)):
+		if seed is not None:
+			randomSeed(levelSeed(seed, num))
+		levelGen = ENGINES[engine](level = num, **levelOpts)
+		levelGen.genGrid(lifish=pack.lifish)
+		levelGen.printLevelGrid(coloredRegions=True)
+		log_err("Rerolled level {}".format(num))
+		entries[num] = levelGen.lifishEntry() if pack.lifish else levelGen.plistEntry()
+	return pack.patch(entries)
+
+
+# level generator classes selectable with --engine
+ENGINES = {
+	'grid': BOOMLevel,
+	'bitboard': BitboardLevel,
+}
+
+
 if __name__ == '__main__':
 	# parse options
 	parser = OptionParser()
@@ -1107,30 +2311,188 @@ if __name__ == '__main__':
 	parser.add_option("-v", "--verbose", action="store_false", dest="quiet", default=True, help="Be more verbose (on the stderr)")
 	parser.add_option("-d", "--difficulty", default='normal', help="Difficulty (easy, normal)")
 	parser.add_option("-l", "--lifish", action="store_true", default=False, help="Emit levels in Lifish format (required for BOOM: Remake)")
+	parser.add_option("--stdlib", action="store_true", default=False, help="Serialize through plistlib/json instead of the built-in templates")
+	parser.add_option("-r", "--rebuild", metavar="PACK", help="Read an existing pack and only regenerate the levels given with --reroll")
+	parser.add_option("--reroll", default='', metavar="N,M,...", help="Comma-separated level numbers to regenerate with --rebuild")
+	parser.add_option("--dedup", metavar="INDEX", help="Reject levels that are (near-)duplicates of the ones in INDEX, and add the new ones to it")
+	parser.add_option("-f", "--fundamental", action="store_true", default=False, help="Generate symmetric levels on half/quarter of the grid and mirror it once")
+	parser.add_option("--engine", type="choice", choices=list(ENGINES), default='grid', help="Level generator engine: " + ', '.join(ENGINES) + " (default: %default)")
+	parser.add_option("--budget-ms", type="float", default=None, metavar="MS", help="Time budget per level: past it, generation switches to cheaper fallbacks")
+	parser.add_option("--budget-iters", type="int", default=None, metavar="N", help="Max iterations of each retry loop per level")
+	parser.add_option("-s", "--seed", type="int", default=None, help="Seed the generation: each level gets its own random stream derived from SEED")
+	parser.add_option("-p", "--profile", metavar="FILE", help="Load the difficulty profile FILE (see boomcalibrate.py)")
+	parser.add_option("--boss-stages", action="store_true", default=False, help="Make every boss level (10, 20, ...) a special stage like the last one, with at least as many bosses as usual")
+	parser.add_option("-b", "--bank", metavar="FILE", help="Take the walls layouts from the layout bank FILE (see boomlayoutbank.py)")
+	parser.add_option("-z", "--compress", action="store_true", default=False, help="Write the pack zlib-compressed with a preset dictionary")
+	parser.add_option("--rle", action="store_true", default=False, help="With --compress, run-length encode the grid strings too")
+	parser.add_option("-x", "--decompress", metavar="FILE", help="Decompress the pack FILE (written with --compress) on STDOUT and exit")
+	parser.add_option("--verify", action="store_true", default=False, help="Check that every level can be cleared (see boomsolve.py) and report the ones which can't on STDERR")
+	parser.add_option("-o", "--out", action="append", default=[], metavar="FORMAT:FILE", help="Write the pack in FORMAT (" + ', '.join(WRITERS) + ") to FILE ('-' for STDOUT). Can be repeated: the levels are generated once for all")
+	parser.add_option("--nav", action="store_true", default=False, help="Add navigation data (walkable bitmap, distance fields, teleport links) to each Lifish level")
+	parser.add_option("--nav-file", metavar="FILE", help="Write the navigation data of all the levels as JSON to FILE")
 	options, args = parser.parse_args()
 	quiet = options.quiet
-
-	if options.lifish:
-		printHeaderLifish()
-		for i in range(1, N_LEVELS + 1):
-			levelGen = BOOMLevel(
-					level = i, 
-					faithfulThemes = options.faithfulThemes, 
+	sinks = []
+	for spec in options.out:
+		fmt, sep, path = spec.partition(':')
+		if not sep or not path or fmt not in WRITERS:
+			parser.error("--out expects FORMAT:FILE, with FORMAT one of " + ', '.join(WRITERS))
+		sinks.append((fmt, path))
+	if bool(options.rebuild) != bool(options.reroll.strip(', ')):
+		parser.error("--rebuild and --reroll must be used together")
+	if options.rebuild and (options.nav or options.nav_file or options.dedup or options.verify):
+		parser.error("--nav, --nav-file, --dedup and --verify can't be used with --rebuild")
+	if sinks and (options.lifish or options.stdlib or options.compress or options.rebuild):
+		parser.error("--out can't be used with -l, --stdlib, --compress or --rebuild")
+	if options.nav and not (options.lifish or any(fmt == 'lifish' for fmt, _ in sinks)):
+		parser.error("--nav needs --lifish (use --nav-file with plists)")
+	if options.rle and not options.compress:
+		parser.error("--rle needs --compress")
+	if options.compress and options.stdlib:
+		parser.error("--compress and --stdlib are mutually exclusive")
+	profile = None
+	if options.profile:
+		try:
+			profile = loadProfile(options.profile)
+		except (OSError, ValueError) as e:
+			parser.error("cannot load profile: {}".format(e))
+
+	bank = None
+	if options.bank:
+		try:
+			with open(options.bank, 'rb'):
+				pass
+			bank = LayoutBank(options.bank)
+		except (OSError, ValueError, sqlite3.Error) as e:
+			parser.error("cannot open layout bank: {}".format(e))
+
+	budgetFactory = lambda: Budget(
+			options.budget_ms / 1000. if options.budget_ms is not None else None,
+			options.budget_iters)
+
+	if options.decompress:
+		try:
+			with open(options.decompress, 'rb') as f:
+				decompressPack(f, stdout)
+		except (OSError, ValueError, zlib.error) as e:
+			parser.error("cannot decompress: {}".format(e))
+	elif options.rebuild:
+		try:
+			reroll = [int(n) for n in options.reroll.split(',') if n.strip()]
+		except ValueError:
+			parser.error("--reroll expects comma-separated level numbers")
+		with open(options.rebuild) as f:
+			text = f.read()
+		budget = budgetFactory()
+		try:
+			stdout.write(rebuildPack(text, reroll, options.engine, options.seed,
+					faithfulThemes = options.faithfulThemes,
 					faithfulEnemies = options.faithfulEnemies,
-					difficulty = options.difficulty
-					)
-			levelGen.genLevelLifish()
-			levelGen.printLevelGrid(coloredRegions=True)
-		printFooterLifish()
+					difficulty = options.difficulty,
+					profile = profile,
+					fundamental = options.fundamental,
+					budget = budget,
+					bank = bank,
+					bossStages = options.boss_stages))
+		except ValueError as e:
+			parser.error(str(e))
+		if budget.hits:
+			stderr.write("Out of budget in: {}\n".format(', '.join(sorted(set(budget.hits)))))
 	else:
-		printHeader()
+		dedup = None
+		if options.dedup:
+			from boomdedup import DedupIndex
+			dedup = DedupIndex(options.dedup, BOOMLevel.WIDTH, BOOMLevel.HEIGHT)
+
+		writers = []
+		for fmt, path in sinks:
+			try:
+				writer = WRITERS[fmt](stdout if path == '-' else open(path, 'w'))
+			except OSError as e:
+				parser.error("cannot write {}: {}".format(path, e))
+			writer.begin()
+			writers.append(writer)
+
+		# the finished levels, as LevelSnapshots
+		levels = []
+		levelOpts = dict(
+				faithfulThemes = options.faithfulThemes, 
+				faithfulEnemies = options.faithfulEnemies,
+				difficulty = options.difficulty,
+				profile = profile,
+				fundamental = options.fundamental,
+				bank = bank,
+				bossStages = options.boss_stages)
+		# a single generator for the whole run, reset for each level (and
+		# each dedup retry) so that its buffers are reused
+		levelGen = ENGINES[options.engine](1)
 		for i in range(1, N_LEVELS + 1):
-			levelGen = BOOMLevel(
-					level = i, 
-					faithfulThemes = options.faithfulThemes, 
-					faithfulEnemies = options.faithfulEnemies,
-					difficulty = options.difficulty
-					)
-			levelGen.genLevel()
+			if options.seed is not None:
+				randomSeed(levelSeed(options.seed, i))
+			for attempt in range(DEDUP_RETRIES):
+				levelGen.reset(i, budget = budgetFactory(), **levelOpts)
+				levelGen.genGrid(lifish=options.lifish)
+				# the last level is a fixed boss stage: don't bother checking it
+				if dedup is None or i == N_LEVELS:
+					break
+				match = dedup.lookup(levelGen.gridString)
+				if match is None:
+					break
+				log_err("Level {} is a {}duplicate (distance {}), regenerating.".format(
+					i, '' if match[2] else 'near-', match[1]))
+			if dedup is not None and i != N_LEVELS:
+				dedup.add(levelGen.gridString)
 			levelGen.printLevelGrid(coloredRegions=True)
-		printFooter()
+			if options.nav:
+				levelGen.navigation()
+			for writer in writers:
+				writer.write(levelGen)
+			levels.append(LevelSnapshot(levelGen))
+
+		if dedup is not None:
+			dedup.close()
+		for writer in writers:
+			writer.end()
+			if writer.out is not stdout:
+				writer.out.close()
+
+		for levelGen in levels:
+			if levelGen.budget.hits:
+				stderr.write("Level {}: out of budget in {}\n".format(
+					levelGen.level, ', '.join(sorted(set(levelGen.budget.hits)))))
+
+		if options.verify:
+			from boomsolve import solve
+			for levelGen in levels:
+				result = solve(levelGen.gridString, BOOMLevel.WIDTH, BOOMLevel.HEIGHT)
+				if not result['solvable']:
+					stderr.write("Level {} may not be solvable: {}\n".format(
+						levelGen.level, '; '.join(result['reasons'])))
+
+		if options.nav_file:
+			for levelGen in levels:
+				if levelGen.nav is None:
+					levelGen.navigation()
+			with open(options.nav_file, 'w') as f:
+				json.dump({
+					'width': BOOMLevel.WIDTH,
+					'height': BOOMLevel.HEIGHT,
+					'levels': [dict(num = lvl.level, **lvl.nav) for lvl in levels],
+				}, f, separators=(',', ':'))
+				f.write('\n')
+			if not options.nav:
+				for levelGen in levels:
+					levelGen.nav = None
+
+		# with --out, the levels were written as they came
+		if writers:
+			pass
+		elif options.stdlib:
+			writePackStdlib(levels, lifish=options.lifish)
+		elif options.compress:
+			buf = io.StringIO()
+			writePack(levels, buf, lifish=options.lifish)
+			stdout.flush()
+			stdout.buffer.write(compressPack(buf.getvalue(), options.rle))
+		else:
+			writePack(levels, lifish=options.lifish)
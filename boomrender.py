@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Render packs as PNG thumbnails or contact sheets.
+#
+# boomrender.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Each tile is drawn as a SCALE x SCALE square of a flat color. The pixel
+# row of every tile character is precomputed once per process, so a level
+# row is just a join of ready-made byte strings, repeated SCALE times.
+#
+# The contact sheet is built a row of levels at a time and fed to a zlib
+# stream as soon as its workers return it, so its memory use does not grow
+# with the number of levels.
+
+from multiprocessing import Pool
+from optparse import OptionParser
+import os
+import struct
+import zlib
+
+from boomlevelgen import BOOMLevel, LevelPack, tiles
+
+PALETTE = {
+	'blank': (40, 48, 40),
+	'fixed': (128, 128, 136),
+	'breakable': (150, 96, 48),
+	'coin': (240, 200, 40),
+	'teleport': (40, 200, 220),
+	'player1': (255, 255, 255),
+	'player2': (160, 200, 255),
+	'boss': (220, 40, 220),
+	'lifish_lastboss': (220, 40, 220),
+}
+# enemies go from light to dark red with their strength
+PALETTE.update({e: (255 - 16 * n, 60, 40) for n, e in enumerate(tiles['enemy'])})
+BACKGROUND = (0, 0, 0)
+
+# per-process cache: scale -> {tile char: pixel row bytes}
+_pixels = {}
+
+
+def tilePixels(scale):
+	if scale not in _pixels:
+		pixels = {}
+		for name, chars in tiles.items():
+			for c in chars:
+				pixels[c] = bytes(PALETTE.get(c) or PALETTE[name]) * scale
+		_pixels[scale] = pixels
+	return _pixels[scale]
+
+
+def renderGrid(grid, width, height, scale):
+	'Returns the pixel rows (RGB bytes, no PNG filter byte) of a level'
+	pixels = tilePixels(scale)
+	blank = pixels[tiles['blank']]
+	# pad or cut malformed grids, rather than failing on them
+	grid = grid[:width * height].ljust(width * height, tiles['blank'])
+	rows = []
+	for y in range(height):
+		row = b''.join(pixels.get(c, blank) for c in grid[y*width:(y+1)*width])
+		rows.extend([row] * scale)
+	return rows
+
+
+def chunk(kind, data):
+	return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def writePng(path, width, height, rows, level = 6):
+	'''Writes an 8-bit RGB PNG. `rows` is an iterable of the pixel rows, which
+	is consumed as the image is compressed.'''
+	z = zlib.compressobj(level)
+	with open(path, 'wb') as f:
+		f.write(b'\x89PNG\r\n\x1a\n')
+		f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+		data = []
+		for row in rows:
+			data.append(z.compress(b'\0' + row))
+		data.append(z.flush())
+		f.write(chunk(b'IDAT', b''.join(data)))
+		f.write(chunk(b'IEND', b''))
+
+
+def renderThumbnail(task):
+	'Worker: writes the thumbnail of a level, returns its path'
+	grid, path, width, height, scale = task
+	writePng(path, width * scale, height * scale, renderGrid(grid, width, height, scale))
+	return path
+
+
+def renderTile(task):
+	'Worker: returns the pixel rows of a level of the contact sheet'
+	grid, width, height, scale = task
+	return renderGrid(grid, width, height, scale)
+
+
+def sheetRows(levels, columns, tileWidth, tileHeight, gap):
+	'''Yields the pixel rows of a contact sheet, given an iterator over the
+	pixel rows of its levels in order'''
+	background = bytes(BACKGROUND)
+	width = columns * (tileWidth + gap) + gap
+	gapRow = background * width
+	gapCol = background * gap
+	emptyTile = [background * tileWidth] * tileHeight
+	levels = iter(levels)
+	done = False
+	while not done:
+		row = []
+		for _ in range(columns):
+			tile = next(levels, None)
+			if tile is None:
+				done = True
+				break
+			row.append(tile)
+		if not row:
+			break
+		row += [emptyTile] * (columns - len(row))
+		for _ in range(gap):
+			yield gapRow
+		for y in range(tileHeight):
+			yield gapCol + gapCol.join(tile[y] for tile in row) + gapCol
+	for _ in range(gap):
+		yield gapRow
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts] PACK...")
+	parser.add_option("-o", "--outdir", default=None, help="Write a PNG thumbnail per level in this directory")
+	parser.add_option("-S", "--sheet", default=None, metavar="FILE", help="Write a single contact sheet PNG with all the levels")
+	parser.add_option("-z", "--scale", type="int", default=4, help="Pixels per tile (default: %default)")
+	parser.add_option("-c", "--columns", type="int", default=20, help="Levels per row of the contact sheet (default: %default)")
+	parser.add_option("-g", "--gap", type="int", default=2, help="Pixels between levels in the contact sheet (default: %default)")
+	parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: one per CPU)")
+	options, args = parser.parse_args()
+	if not args:
+		parser.error("need some packs to render")
+	if not options.outdir and not options.sheet:
+		parser.error("nothing to do: pass --outdir and/or --sheet")
+	if options.scale < 1 or options.columns < 1 or options.gap < 0:
+		parser.error("bad --scale, --columns or --gap")
+
+	width, height, scale = BOOMLevel.WIDTH, BOOMLevel.HEIGHT, options.scale
+	levels = []
+	for path in args:
+		with open(path) as f:
+			pack = LevelPack(f.read())
+		name = os.path.splitext(os.path.basename(path))[0]
+		levels += [(pack.grid(num), '{}-{:02d}.png'.format(name, num)) for num in sorted(pack.spans)]
+
+	with Pool(options.jobs) as pool:
+		if options.outdir:
+			os.makedirs(options.outdir, exist_ok=True)
+			tasks = [(grid, os.path.join(options.outdir, name), width, height, scale) for grid, name in levels]
+			for _ in pool.imap_unordered(renderThumbnail, tasks, chunksize=32):
+				pass
+			print("Wrote {} thumbnails to {}".format(len(levels), options.outdir))
+		if options.sheet:
+			columns = min(options.columns, len(levels))
+			rows = -(-len(levels) // columns)
+			tw, th, gap = width * scale, height * scale, options.gap
+			rendered = pool.imap(renderTile, [(grid, width, height, scale) for grid, _ in levels], chunksize=32)
+			writePng(options.sheet, columns * (tw + gap) + gap, rows * (th + gap) + gap,
+					sheetRows(rendered, columns, tw, th, gap))
+			print("Wrote {} levels to {}".format(len(levels), options.sheet))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Search the seed space for levels matching a query.
+#
+# boomsearch.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Level L of `boomlevelgen.py -s SEED` comes from its own random stream
+# levelSeed(SEED, L), so a level can be looked for by generating level L
+# alone for many seeds. The query is checked by the generator as soon as
+# each property is chosen (see BOOMLevel.decided): e.g. with --symmetry, 3
+# candidates out of 4 are dropped after a single random draw, and with
+# --walls before any wall is built.
+#
+# The matches are printed as JSON lines as they are found. The seed ranges
+# already scanned for a query, and the matches in them, are kept in a
+# sqlite cache: searching again, or over a wider range, only scans the new
+# seeds. The cache must be deleted when the generator changes.
+
+from multiprocessing import Pool
+from optparse import OptionParser
+import json
+import sqlite3
+import sys
+import time
+
+import boomlevelgen
+from boomlevelgen import (BOOMLevel, DECISIONS, ENGINES, N_LEVELS, Rejected, SYM_AXIAL_X, SYM_AXIAL_Y,
+		SYM_CENTRAL, SYM_NONE, levelSeed, loadProfile, randomSeed, tiles)
+
+SYMMETRIES = {'none': SYM_NONE, 'axial-x': SYM_AXIAL_X, 'axial-y': SYM_AXIAL_Y, 'central': SYM_CENTRAL}
+SYMMETRY_NAMES = {v: k for k, v in SYMMETRIES.items()}
+WALLS_ALGS = ('walkers', 'regular', 'random')
+
+
+def parseRange(text):
+	'Parses "N", "N-M", "N-" or "-M" into (min, max), None meaning unbounded'
+	lo, sep, hi = text.partition('-')
+	lo = int(lo) if lo else None
+	hi = int(hi) if hi else None if sep else lo
+	if lo is not None and hi is not None and lo > hi:
+		raise ValueError("empty range '{}'".format(text))
+	return lo, hi
+
+
+def inRange(n, bounds):
+	lo, hi = bounds
+	return (lo is None or n >= lo) and (hi is None or n <= hi)
+
+
+class Query:
+	"""The properties wanted for a level. It is passed to BOOMLevel as its
+	accept callback, which checks what is known at each step, and match()
+	checks the finished level."""
+
+	def __init__(self, symmetry = None, walls = None, teleports = None, enemies = None, coins = None,
+			enemyDistance = None, solvable = False):
+		self.symmetry = symmetry
+		self.walls = walls
+		self.teleports = teleports
+		self.enemies = enemies
+		self.coins = coins
+		# no enemy may be this close (or closer) to a player spawn
+		self.enemyDistance = enemyDistance
+		self.solvable = solvable
+
+	def key(self):
+		return dict(vars(self))
+
+	def __call__(self, level, step):
+		known = DECISIONS.index(step)
+		if self.symmetry is not None and level.symmetry != self.symmetry:
+			return False
+		# walls may still replace teleports until the layout is done, and in
+		# fundamental mode the teleports are only mirrored at the end
+		if known >= DECISIONS.index('layout') and self.teleports is not None and level.domain is None:
+			count = sum(row.count(tiles['teleport']) for row in level.grid)
+			if not inRange(count, self.teleports):
+				return False
+		if known >= DECISIONS.index('wallsAlg') and self.walls is not None and level.wallsAlg != self.walls:
+			return False
+		return True
+
+	def match(self, level):
+		'Returns the properties of a finished level if it matches, else None'
+		grid = level.gridString
+		width = BOOMLevel.WIDTH
+		# special stages have no walls algorithm, nor symmetry
+		symmetry = level.symmetry if level.wallsAlg is not None else None
+		if self.symmetry is not None and symmetry != self.symmetry:
+			return None
+		if self.walls is not None and level.wallsAlg != self.walls:
+			return None
+		teleports = grid.count(tiles['teleport'])
+		if self.teleports is not None and not inRange(teleports, self.teleports):
+			return None
+		enemies = [n for n, c in enumerate(grid) if c in tiles['enemy']]
+		if self.enemies is not None and not inRange(len(enemies), self.enemies):
+			return None
+		coins = grid.count(tiles['coin'])
+		if self.coins is not None and not inRange(coins, self.coins):
+			return None
+		spawns = [grid.find(tiles['player1']), grid.find(tiles['player2'])]
+		distance = min((abs(e % width - s % width) + abs(e // width - s // width)
+				for e in enemies for s in spawns if s >= 0), default=None)
+		if self.enemyDistance is not None and distance is not None and distance <= self.enemyDistance:
+			return None
+		result = {
+			'symmetry': SYMMETRY_NAMES.get(symmetry),
+			'walls': level.wallsAlg,
+			'teleports': teleports,
+			'enemies': len(enemies),
+			'coins': coins,
+			'enemyDistance': distance,
+		}
+		if self.solvable:
+			from boomsolve import solve
+			if not solve(grid, width, BOOMLevel.HEIGHT)['solvable']:
+				return None
+			result['solvable'] = True
+		result['grid'] = grid
+		return result
+
+
+class SearchCache:
+	"""sqlite cache of the seed ranges scanned for each search (a query with
+	the level and generator options) and of the matches found in them."""
+
+	def __init__(self, path, search):
+		self.db = sqlite3.connect(path)
+		self.key = json.dumps(search, sort_keys=True)
+		self.db.execute('CREATE TABLE IF NOT EXISTS scanned (search TEXT, lo INTEGER, hi INTEGER)')
+		self.db.execute('''CREATE TABLE IF NOT EXISTS matches (search TEXT, seed INTEGER, result TEXT,
+				PRIMARY KEY (search, seed)) WITHOUT ROWID''')
+		self.db.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		'Merges the scanned ranges of this search and closes the cache'
+		ranges = self.scanned()
+		with self.db:
+			self.db.execute('DELETE FROM scanned WHERE search = ?', (self.key,))
+			self.db.executemany('INSERT INTO scanned VALUES (?, ?, ?)', [(self.key, lo, hi) for lo, hi in ranges])
+		self.db.close()
+
+	def scanned(self):
+		'Returns the sorted, merged [lo, hi) seed ranges already scanned'
+		ranges = []
+		for lo, hi in self.db.execute('SELECT lo, hi FROM scanned WHERE search = ? ORDER BY lo', (self.key,)):
+			if ranges and lo <= ranges[-1][1]:
+				ranges[-1] = (ranges[-1][0], max(hi, ranges[-1][1]))
+			else:
+				ranges.append((lo, hi))
+		return ranges
+
+	def missing(self, lo, hi):
+		'Returns the parts of the seed range [lo, hi) not scanned yet'
+		out = []
+		for slo, shi in self.scanned():
+			if slo > lo:
+				out.append((lo, min(slo, hi)))
+			lo = max(lo, shi)
+			if lo >= hi:
+				break
+		if lo < hi:
+			out.append((lo, hi))
+		return out
+
+	def matches(self, lo, hi):
+		'Yields the cached matches with seeds in [lo, hi)'
+		for seed, result in self.db.execute(
+				'SELECT seed, result FROM matches WHERE search = ? AND seed >= ? AND seed < ? ORDER BY seed',
+				(self.key, lo, hi)):
+			yield dict(seed = seed, **json.loads(result))
+
+	def add(self, lo, hi, matches):
+		'Records that [lo, hi) was scanned, with its matches'
+		with self.db:
+			self.db.execute('INSERT INTO scanned VALUES (?, ?, ?)', (self.key, lo, hi))
+			self.db.executemany('INSERT OR REPLACE INTO matches VALUES (?, ?, ?)',
+					[(self.key, m['seed'], json.dumps({k: v for k, v in m.items() if k != 'seed'}))
+					for m in matches])
+
+
+def searchSeeds(task):
+	'''Worker: generates the level with each seed of a range, returns the
+	range, its matches and how many seeds were rejected early'''
+	level, seeds, query, engine, opts = task
+	boomlevelgen.quiet = True
+	levelGen = None
+	matches = []
+	rejected = 0
+	for seed in seeds:
+		# the same stream `boomlevelgen.py -s SEED` uses for this level
+		randomSeed(levelSeed(seed, level))
+		if levelGen is None:
+			levelGen = ENGINES[engine](level, accept = query, **opts)
+		else:
+			levelGen.reset(level, accept = query, **opts)
+		try:
+			levelGen.genGrid()
+		except Rejected:
+			rejected += 1
+			continue
+		result = query.match(levelGen)
+		if result is not None:
+			matches.append(dict(seed = seed, **result))
+	return seeds.start, seeds.stop, matches, rejected
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts] LEVEL")
+	parser.add_option("-s", "--seed", type="int", default=0, help="First seed to scan (default: %default)")
+	parser.add_option("-n", "--seeds", type="int", default=100000, help="Number of seeds to scan (default: %default)")
+	parser.add_option("-m", "--max", type="int", default=None, help="Stop after finding this many matches")
+	parser.add_option("--symmetry", type="choice", choices=list(SYMMETRIES), help="Symmetry: " + ', '.join(SYMMETRIES))
+	parser.add_option("--walls", type="choice", choices=WALLS_ALGS, help="Walls algorithm: " + ', '.join(WALLS_ALGS))
+	parser.add_option("--teleports", metavar="RANGE", help="Number of teleports, as N, N-M, N- or -M")
+	parser.add_option("--enemies", metavar="RANGE", help="Number of enemies, as N, N-M, N- or -M")
+	parser.add_option("--coins", metavar="RANGE", help="Number of coins, as N, N-M, N- or -M")
+	parser.add_option("--no-enemy-within", type="int", metavar="D", help="No enemy at D tiles or less (Manhattan distance) from a player spawn")
+	parser.add_option("--solvable", action="store_true", default=False, help="The level must pass boomsolve.py")
+	parser.add_option("-t", "--faithfulThemes", action="store_true", default=False)
+	parser.add_option("-e", "--faithfulEnemies", action="store_true", default=False)
+	parser.add_option("-d", "--difficulty", default='normal', help="Difficulty (easy, normal)")
+	parser.add_option("-f", "--fundamental", action="store_true", default=False)
+	parser.add_option("--engine", type="choice", choices=list(ENGINES), default='grid', help="Level generator engine (default: %default)")
+	parser.add_option("-p", "--profile", metavar="FILE", help="Difficulty profile (see boomcalibrate.py)")
+	parser.add_option("--boss-stages", action="store_true", default=False)
+	parser.add_option("-c", "--cache", default="boomsearch.db", metavar="FILE", help="Cache of the scanned seeds (default: %default)")
+	parser.add_option("--no-cache", action="store_true", default=False, help="Don't read nor update the cache")
+	parser.add_option("--chunk", type="int", default=500, help="Seeds per task (default: %default)")
+	parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: one per CPU)")
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("need the level number")
+	try:
+		level = int(args[0])
+		if not 1 <= level <= N_LEVELS:
+			raise ValueError("level out of range")
+		query = Query(
+				symmetry = SYMMETRIES.get(options.symmetry),
+				walls = options.walls,
+				teleports = parseRange(options.teleports) if options.teleports else None,
+				enemies = parseRange(options.enemies) if options.enemies else None,
+				coins = parseRange(options.coins) if options.coins else None,
+				enemyDistance = options.no_enemy_within,
+				solvable = options.solvable)
+	except ValueError as e:
+		parser.error(str(e))
+	if options.seeds < 1 or options.chunk < 1:
+		parser.error("bad --seeds or --chunk")
+	profile = None
+	if options.profile:
+		try:
+			profile = loadProfile(options.profile)
+		except (OSError, ValueError) as e:
+			parser.error("cannot load profile: {}".format(e))
+
+	opts = dict(
+			faithfulThemes = options.faithfulThemes,
+			faithfulEnemies = options.faithfulEnemies,
+			difficulty = options.difficulty,
+			profile = profile,
+			fundamental = options.fundamental,
+			bossStages = options.boss_stages)
+	lo, hi = options.seed, options.seed + options.seeds
+	search = dict(level = level, engine = options.engine, query = query.key(), **opts)
+	cache = None if options.no_cache else SearchCache(options.cache, search)
+
+	found = fromCache = scanned = rejected = 0
+	start = time.perf_counter()
+	def emit(result):
+		global found
+		found += 1
+		print(json.dumps(dict(level = level, **result), separators=(',', ':')), flush=True)
+		return options.max is not None and found >= options.max
+
+	try:
+		done = False
+		todo = [(lo, hi)]
+		if cache is not None:
+			for result in cache.matches(lo, hi):
+				fromCache += 1
+				if emit(result):
+					done = True
+					break
+			todo = cache.missing(lo, hi)
+		tasks = [(level, range(s, min(s + options.chunk, e)), query, options.engine, opts)
+				for s, e in todo for s in range(s, e, options.chunk)]
+		if not done and tasks:
+			with Pool(options.jobs) as pool:
+				for s, e, matches, nrejected in pool.imap(searchSeeds, tasks):
+					scanned += e - s
+					rejected += nrejected
+					if cache is not None:
+						cache.add(s, e, matches)
+					if any(emit(result) for result in matches):
+						break
+	finally:
+		if cache is not None:
+			cache.close()
+
+	elapsed = time.perf_counter() - start
+	sys.stderr.write("{} matches ({} from the cache); scanned {} seeds in {:.1f}s, {} rejected early\n".format(
+		found, fromCache, scanned, elapsed, rejected))
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Split pack generation across several hosts sharing a filesystem.
+#
+# boomshard.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Usage:
+#   boomshard.py plan DIR --seeds 0:100 --shards 8 [generation opts]
+#   boomshard.py run DIR SHARD      (or --any, on every node)
+#   boomshard.py status DIR
+#   boomshard.py merge DIR [-l]
+#
+# `plan` splits the (seed range x level range) workload into units, i.e.
+# a seed and a range of its levels, and assigns them to shard manifests.
+# Each pack is generated from one seed, with a random stream per level
+# (boomlevelgen.levelSeed), so every unit can be generated anywhere and in
+# any order, and the merged pack of seed S is the same as the output of
+# `boomlevelgen.py -s S` with the same options. For the same reason only
+# --budget-iters is accepted: with --budget-ms the fallbacks taken, hence
+# the levels, would depend on how fast each node is.
+#
+# `run` writes each unit to DIR/out as a binary file, atomically, followed
+# by its sha256 checksum file: a unit is done once its checksum exists and
+# matches, so a node that died can simply be restarted and will skip the
+# units already done. With --any a node claims the first shard nobody has
+# claimed yet (through an O_EXCL lock file holding its --node name), runs
+# it, then claims the next one. A restarted node first resumes the shards
+# it claimed before but did not complete. --steal also takes shards
+# claimed by other nodes but not complete, which is safe since generating
+# a unit twice gives the same bytes.
+#
+# `merge` verifies that every unit is present and intact and writes one
+# pack per seed to DIR/packs, in level order.
+
+from hashlib import sha256
+from optparse import OptionParser
+import json
+import os
+import random
+import socket
+import struct
+import sys
+
+import boomlevelgen
+from boomlevelgen import BOOMLevel, ENGINES, Budget, N_LEVELS, levelSeed, loadProfile, \
+	tiles, writePack
+
+MAGIC = b'BLG1'
+HEADER = struct.Struct('<4sI')
+# level, time, bgPatternID, borderID, breakableBlockID, fixedBlockID, symmetry, wallsAlg, grid length
+RECORD = struct.Struct('<HHBBBBBBH')
+WALLS_ALGS = [None, 'walkers', 'regular', 'random']
+
+
+def manifestPath(dir):
+	return os.path.join(dir, 'manifest.json')
+
+
+def shardPath(dir, shard):
+	return os.path.join(dir, 'shards', 'shard-{:04d}.json'.format(shard))
+
+
+def unitPath(dir, seed, lo, hi):
+	return os.path.join(dir, 'out', '{}-{}-{}.bin'.format(seed, lo, hi))
+
+
+def writeAtomic(path, data):
+	tmp = '{}.{}.{}.tmp'.format(path, socket.gethostname(), os.getpid())
+	with open(tmp, 'wb') as f:
+		f.write(data)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, path)
+
+
+def readJson(path):
+	with open(path) as f:
+		return json.load(f)
+
+
+def plan(dir, seeds, levels, nshards, chunk, options):
+	units = []
+	for seed in range(*seeds):
+		for lo in range(levels[0], levels[1] + 1, chunk):
+			units.append([seed, lo, min(levels[1], lo + chunk - 1)])
+	if not units:
+		raise ValueError("empty workload")
+	nshards = min(nshards, len(units))
+	for sub in ('shards', 'out', 'locks', 'packs'):
+		os.makedirs(os.path.join(dir, sub), exist_ok=True)
+	for k in range(nshards):
+		shardUnits = units[k * len(units) // nshards:(k + 1) * len(units) // nshards]
+		writeAtomic(shardPath(dir, k), json.dumps({'shard': k, 'units': shardUnits}).encode())
+	writeAtomic(manifestPath(dir), json.dumps({
+		'version': 1,
+		'seeds': list(seeds),
+		'levels': list(levels),
+		'shards': nshards,
+		'units': len(units),
+		'options': options,
+	}, indent='\t').encode())
+	return nshards, len(units)
+
+
+def encodeUnit(levels):
+	out = [HEADER.pack(MAGIC, len(levels))]
+	for lvl in levels:
+		grid = lvl.gridString.encode()
+		out.append(RECORD.pack(lvl.level, lvl.time, lvl.bgPatternID, lvl.borderID,
+			lvl.breakableBlockID, lvl.fixedBlockID, lvl.symmetry,
+			WALLS_ALGS.index(lvl.wallsAlg), len(grid)))
+		out.append(grid)
+	return b''.join(out)
+
+
+def decodeUnit(data):
+	'Returns the list of levels in a unit file, as BOOMLevel objects'
+	magic, count = HEADER.unpack_from(data)
+	if magic != MAGIC:
+		raise ValueError("not a unit file")
+	pos = HEADER.size
+	levels = []
+	for _ in range(count):
+		num, time, bg, border, breakable, fixed, sym, alg, size = RECORD.unpack_from(data, pos)
+		pos += RECORD.size
+		lvl = BOOMLevel(num)
+		lvl.time, lvl.bgPatternID, lvl.borderID = time, bg, border
+		lvl.breakableBlockID, lvl.fixedBlockID = breakable, fixed
+		lvl.symmetry, lvl.wallsAlg = sym, WALLS_ALGS[alg]
+		lvl.gridString = data[pos:pos+size].decode()
+		pos += size
+		levels.append(lvl)
+	return levels
+
+
+def unitDone(path):
+	'Returns the content of a completed unit file, or None'
+	try:
+		with open(path + '.sha256') as f:
+			digest = f.read().strip()
+		with open(path, 'rb') as f:
+			data = f.read()
+	except OSError:
+		return None
+	return data if sha256(data).hexdigest() == digest else None
+
+
+def genUnit(seed, lo, hi, options):
+	cls = ENGINES[options['engine']]
+	levels = []
+	for num in range(lo, hi + 1):
+		random.seed(levelSeed(seed, num))
+		budget = Budget(iterations = options['budgetIters'])
+		lvl = cls(level = num,
+				faithfulThemes = options['faithfulThemes'],
+				faithfulEnemies = options['faithfulEnemies'],
+				difficulty = options['difficulty'],
+				profile = options['profile'],
+				fundamental = options['fundamental'],
+				budget = budget)
+		lvl.genGrid()
+		if budget.hits:
+			sys.stderr.write("seed {} level {}: out of budget in {}\n".format(
+				seed, num, ', '.join(sorted(set(budget.hits)))))
+		levels.append(lvl)
+	return levels
+
+
+def runShard(dir, shard, options):
+	'Generates all the missing units of a shard. Returns the number generated.'
+	done = 0
+	for seed, lo, hi in readJson(shardPath(dir, shard))['units']:
+		path = unitPath(dir, seed, lo, hi)
+		if unitDone(path) is not None:
+			continue
+		data = encodeUnit(genUnit(seed, lo, hi, options))
+		writeAtomic(path, data)
+		writeAtomic(path + '.sha256', (sha256(data).hexdigest() + '\n').encode())
+		done += 1
+	return done
+
+
+def shardComplete(dir, shard):
+	return all(unitDone(unitPath(dir, *unit)) is not None
+			for unit in readJson(shardPath(dir, shard))['units'])
+
+
+def lockPath(dir, shard):
+	return os.path.join(dir, 'locks', 'shard-{:04d}.lock'.format(shard))
+
+
+def claim(dir, shard, node):
+	'Tries to claim a shard for the node `node`. Returns True on success.'
+	try:
+		fd = os.open(lockPath(dir, shard), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+	except FileExistsError:
+		return False
+	os.write(fd, '{} {}\n'.format(node, os.getpid()).encode())
+	os.close(fd)
+	return True
+
+
+def claimedBy(dir, shard):
+	'Returns the name of the node which claimed a shard, or None'
+	try:
+		with open(lockPath(dir, shard)) as f:
+			return f.read().split()[0]
+	except (OSError, IndexError):
+		return None
+
+
+def nextShard(dir, nshards, node, steal, skip):
+	"""Returns the next shard for `node` to run, claiming it if needed, or
+	None if there is none left. Shards in `skip` are not considered."""
+	shards = [k for k in range(nshards) if k not in skip]
+	# first resume the shards this node claimed before, e.g. before a crash
+	for k in shards:
+		if claimedBy(dir, k) == node and not shardComplete(dir, k):
+			return k
+	for k in shards:
+		if claim(dir, k, node):
+			return k
+	if steal:
+		for k in shards:
+			if not shardComplete(dir, k):
+				return k
+	return None
+
+
+def missingUnits(dir, manifest):
+	missing = []
+	for shard in range(manifest['shards']):
+		for unit in readJson(shardPath(dir, shard))['units']:
+			if unitDone(unitPath(dir, *unit)) is None:
+				missing.append((shard, unit))
+	return missing
+
+
+def merge(dir, manifest, lifish):
+	'Writes the pack of every seed. Returns the list of written paths.'
+	units = {}
+	for shard in range(manifest['shards']):
+		for seed, lo, hi in readJson(shardPath(dir, shard))['units']:
+			units.setdefault(seed, []).append((lo, hi))
+	lo, hi = manifest['levels']
+	written = []
+	for seed in range(*manifest['seeds']):
+		levels = {}
+		for ulo, uhi in sorted(units.get(seed, [])):
+			data = unitDone(unitPath(dir, seed, ulo, uhi))
+			if data is None:
+				raise ValueError("seed {}: unit {}-{} is missing or corrupted".format(seed, ulo, uhi))
+			for lvl in decodeUnit(data):
+				if lvl.level in levels:
+					raise ValueError("seed {}: level {} appears twice".format(seed, lvl.level))
+				levels[lvl.level] = lvl
+		missing = set(range(lo, hi + 1)) - set(levels)
+		if missing:
+			raise ValueError("seed {}: missing levels {}".format(seed, sorted(missing)))
+		ordered = [levels[n] for n in range(lo, hi + 1)]
+		if lifish and N_LEVELS in levels:
+			last = levels[N_LEVELS]
+			last.gridString = last.gridString.replace(tiles['boss'], tiles['lifish_lastboss'])
+		path = os.path.join(dir, 'packs', '{}.{}'.format(seed, 'json' if lifish else 'plist'))
+		with open(path + '.tmp', 'w') as f:
+			writePack(ordered, f, lifish)
+		os.replace(path + '.tmp', path)
+		written.append(path)
+	return written
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog plan|run|status|merge DIR [SHARD] [opts]")
+	parser.add_option("--seeds", default="0:1", help="plan: seed range START:END, END excluded (default: %default)")
+	parser.add_option("-L", "--levels", default="1-{}".format(N_LEVELS), help="plan: level range (default: %default)")
+	parser.add_option("--shards", type="int", default=1, help="plan: number of shards (default: %default)")
+	parser.add_option("--chunk", type="int", default=N_LEVELS, help="plan: max levels per unit (default: %default)")
+	parser.add_option("--engine", type="choice", choices=list(ENGINES), default='grid')
+	parser.add_option("-t", "--faithfulThemes", action="store_true", default=False)
+	parser.add_option("-e", "--faithfulEnemies", action="store_true", default=False)
+	parser.add_option("-d", "--difficulty", default='normal')
+	parser.add_option("-f", "--fundamental", action="store_true", default=False)
+	parser.add_option("-p", "--profile", metavar="FILE", help="plan: difficulty profile, embedded in the manifest")
+	parser.add_option("--budget-ms", type="float", default=None, help="not supported: a time budget makes the output depend on the speed of each node")
+	parser.add_option("--budget-iters", type="int", default=None, help="plan: cap the iterations of each retry loop, like boomlevelgen.py --budget-iters")
+	parser.add_option("--any", action="store_true", default=False, help="run: claim and run unclaimed shards until none is left")
+	parser.add_option("--steal", action="store_true", default=False, help="run --any: also run incomplete shards claimed by other nodes")
+	parser.add_option("--node", default=socket.gethostname(), help="run --any: name of this node in the locks, to resume its shards after a restart (default: %default)")
+	parser.add_option("-l", "--lifish", action="store_true", default=False, help="merge: write Lifish packs")
+	options, args = parser.parse_args()
+	if len(args) < 2:
+		parser.error("need a command and a directory")
+	command, dir = args[0], args[1]
+	boomlevelgen.quiet = True
+
+	if command == 'plan':
+		if options.budget_ms is not None:
+			parser.error("--budget-ms would make the packs depend on the speed of the nodes: use --budget-iters")
+		try:
+			first, last = options.seeds.split(':')
+			lo, _, hi = options.levels.partition('-')
+			nshards, nunits = plan(dir, (int(first), int(last)), (int(lo), int(hi or lo)),
+				options.shards, options.chunk, {
+					'engine': options.engine,
+					'faithfulThemes': options.faithfulThemes,
+					'faithfulEnemies': options.faithfulEnemies,
+					'difficulty': options.difficulty,
+					'fundamental': options.fundamental,
+					'profile': loadProfile(options.profile) if options.profile else None,
+					'budgetIters': options.budget_iters,
+				})
+		except ValueError as e:
+			parser.error(str(e))
+		print("Planned {} units in {} shards".format(nunits, nshards))
+
+	elif command == 'run':
+		manifest = readJson(manifestPath(dir))
+		if options.any:
+			# claim a shard only when ready to run it, so that the other
+			# nodes get the rest
+			done = set()
+			while True:
+				k = nextShard(dir, manifest['shards'], options.node, options.steal, done)
+				if k is None:
+					break
+				n = runShard(dir, k, manifest['options'])
+				done.add(k)
+				print("shard {}: generated {} unit(s)".format(k, n))
+		elif len(args) == 3:
+			k = int(args[2])
+			n = runShard(dir, k, manifest['options'])
+			print("shard {}: generated {} unit(s)".format(k, n))
+		else:
+			parser.error("run needs a SHARD number or --any")
+
+	elif command == 'status':
+		manifest = readJson(manifestPath(dir))
+		missing = missingUnits(dir, manifest)
+		print("{}/{} units done".format(manifest['units'] - len(missing), manifest['units']))
+		for shard, (seed, lo, hi) in missing:
+			print("  shard {}: seed {} levels {}-{}".format(shard, seed, lo, hi))
+		sys.exit(1 if missing else 0)
+
+	elif command == 'merge':
+		manifest = readJson(manifestPath(dir))
+		try:
+			written = merge(dir, manifest, options.lifish)
+		except ValueError as e:
+			sys.stderr.write("merge failed: {}\n".format(e))
+			sys.exit(1)
+		print("Wrote {} pack(s) to {}".format(len(written), os.path.join(dir, 'packs')))
+
+	else:
+		parser.error("unknown command '{}'".format(command))
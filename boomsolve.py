@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# Copyright (C) 2022 silverweed
+# BOOM random level generator
+# Check that levels can be cleared, bombs and teleports included.
+#
+# boomsolve.py
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A level is solvable if each player can hit every enemy and boss with a
+# bomb. The model:
+#  - players walk on any cell but fixed walls and boss footprints (the 3x3
+#    square whose top-left corner holds the boss tile), until the boss is
+#    killed;
+#  - a breakable wall can be walked on after bombing it, which costs a bomb;
+#  - a teleport leads to any other teleport (its destination is random, so
+#    the player can retry until it gets the one it wants);
+#  - a bomb hits the cells within BLAST cells of it in a straight line,
+#    stopping at the first wall;
+#  - the first bomb of a player must leave it a cell to hide, i.e. a cell it
+#    can walk to which the blast does not reach.
+#
+# A state of the search is a player position plus the set of walls bombed
+# and bosses killed so far, but bombing is monotone: a bombed wall or a
+# killed boss never comes back, and having bombed more never prevents a
+# move. So the states collapse to the cells, each keeping the fewest bombs
+# it was reached with (the transposition table), and the search is a 0-1
+# BFS where entering a breakable wall costs 1, repeated with the footprints
+# of the bosses it can kill opened until no more boss can be reached. For
+# each target, the proof is the cell the bomb is dropped from and the bombs
+# needed to get there (not counting the ones spent on bosses in the way).
+#
+# This module only needs the tile characters, so boomlevelgen.py can import
+# it lazily for --verify.
+
+from collections import deque
+from multiprocessing import Pool
+from optparse import OptionParser
+import json
+import random
+import sys
+
+FIXED = '1'
+BREAKABLE = '2'
+TELEPORT = '+'
+PLAYERS = 'XY'
+ENEMIES = 'ABCDEFGHIJ'
+BOSSES = '*/'
+
+DEFAULT_BLAST = 1
+UNREACHED = -1
+
+
+class Board:
+	'The static data of a level grid, as flat arrays'
+	def __init__(self, grid, width, height):
+		if len(grid) != width * height:
+			raise ValueError("grid has {} cells, expected {}".format(len(grid), width * height))
+		self.grid = grid
+		self.width = width
+		self.height = height
+		n = width * height
+		self.bosses = [i for i, c in enumerate(grid) if c in BOSSES]
+		# boss -> cells of its footprint
+		self.footprints = {}
+		for i in self.bosses:
+			x, y = i % width, i // width
+			self.footprints[i] = {yy * width + xx for yy in range(y, min(height, y + 3))
+					for xx in range(x, min(width, x + 3))}
+		self.fixed = [grid[i] == FIXED for i in range(n)]
+		self.killed = set()
+		self.blocked = None
+		self.kill(())
+		self.breakable = [grid[i] == BREAKABLE for i in range(n)]
+		self.teleports = [i for i, c in enumerate(grid) if c == TELEPORT]
+		self.neigh = []
+		for i in range(n):
+			x = i % width
+			ns = []
+			if x > 0: ns.append(i - 1)
+			if x < width - 1: ns.append(i + 1)
+			if i >= width: ns.append(i - width)
+			if i + width < n: ns.append(i + width)
+			self.neigh.append(ns)
+
+	def kill(self, bosses):
+		'Opens the footprints of the given bosses'
+		self.killed.update(bosses)
+		footprint = set()
+		for b in self.bosses:
+			if b not in self.killed:
+				footprint |= self.footprints[b]
+		self.blocked = [self.fixed[i] or i in footprint for i in range(len(self.grid))]
+
+	def ray(self, i, dx, dy, length):
+		'Yields the cells from `i` in direction (dx, dy), up to `length` of them'
+		x, y = i % self.width, i // self.width
+		for _ in range(length):
+			x += dx
+			y += dy
+			if not (0 <= x < self.width and 0 <= y < self.height):
+				return
+			yield y * self.width + x
+
+	def blast(self, i, radius, stopAt):
+		'Returns the cells hit by a bomb in `i`, the blast stopping at stopAt(cell)'
+		hit = {i}
+		for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+			for j in self.ray(i, dx, dy, radius):
+				hit.add(j)
+				if stopAt(j):
+					break
+		return hit
+
+
+def search(board, start, maxNodes = None):
+	"""0-1 BFS from `start`. Returns (bombs, parents, expanded), where
+	bombs[i] is the fewest bombs needed to stand on cell i (UNREACHED if it
+	can't be reached), or None if maxNodes was exceeded."""
+	n = board.width * board.height
+	bombs = [UNREACHED] * n
+	parents = [None] * n
+	bombs[start] = 0
+	queue = deque([start])
+	done = [False] * n
+	expanded = 0
+	while queue:
+		i = queue.popleft()
+		if done[i]:
+			continue
+		done[i] = True
+		expanded += 1
+		if maxNodes is not None and expanded > maxNodes:
+			return None, None, expanded
+		cost = bombs[i]
+		neigh = board.neigh[i]
+		if board.grid[i] == TELEPORT:
+			neigh = neigh + board.teleports
+		for j in neigh:
+			if board.blocked[j] or done[j]:
+				continue
+			c = cost + board.breakable[j]
+			if bombs[j] == UNREACHED or c < bombs[j]:
+				bombs[j] = c
+				parents[j] = i
+				if board.breakable[j]:
+					queue.append(j)
+				else:
+					queue.appendleft(j)
+	return bombs, parents, expanded
+
+
+def path(parents, cell):
+	out = []
+	while cell is not None:
+		out.append(cell)
+		cell = parents[cell]
+	return out[::-1]
+
+
+def solve(grid, width = 15, height = 13, blast = DEFAULT_BLAST, maxNodes = None, withPaths = False):
+	"""Checks that `grid` can be cleared by each player. Returns a dict with
+	'solvable' (True, False, or None if the search bound was hit),
+	'reasons' (why it's not solvable), 'bombs' (the most bombs needed to
+	hit a target) and 'proof': for each player and target, the cell the bomb
+	is dropped from and the bombs needed (and the path, with `withPaths`)."""
+	result = {'solvable': True, 'reasons': [], 'bombs': 0, 'proof': {}, 'expanded': 0}
+	def fail(reason):
+		result['solvable'] = False
+		result['reasons'].append(reason)
+
+	try:
+		board = Board(grid, width, height)
+	except ValueError as e:
+		fail(str(e))
+		return result
+	xy = lambda i: [i % width, i // width]
+	targets = [('enemy', i) for i, c in enumerate(grid) if c in ENEMIES] + \
+			[('boss', i) for i in board.bosses]
+	# where a bomb must be dropped to hit each target
+	stopAt = lambda j: board.blocked[j] or board.breakable[j]
+	bombSpots = {}
+	for kind, t in targets:
+		cells = board.footprints[t] if kind == 'boss' else {t}
+		spots = set()
+		for c in cells:
+			spots |= {j for j in board.blast(c, blast, stopAt) if not board.blocked[j]}
+		bombSpots[t] = spots
+
+	for p in PLAYERS:
+		count = grid.count(p)
+		if count != 1:
+			fail("player {} appears {} times".format(p, count))
+			continue
+		start = grid.index(p)
+		board.killed.clear()
+		board.kill(())
+		while True:
+			bombs, parents, expanded = search(board, start, maxNodes)
+			result['expanded'] += expanded
+			if bombs is None:
+				break
+			killable = [b for b in board.bosses if b not in board.killed
+					and any(bombs[j] != UNREACHED for j in bombSpots[b])]
+			if not killable:
+				break
+			board.kill(killable)
+		if bombs is None:
+			result['solvable'] = None
+			result['reasons'].append("search bound exceeded for player {}".format(p))
+			continue
+		proof = result['proof'][p] = []
+		for kind, t in targets:
+			reached = [j for j in bombSpots[t] if bombs[j] != UNREACHED]
+			if not reached:
+				fail("player {} cannot hit the {} at {}".format(p, kind, xy(t)))
+				continue
+			best = min(reached, key=lambda j: (bombs[j], j))
+			step = {'target': kind, 'at': xy(t), 'from': xy(best), 'bombs': bombs[best]}
+			if withPaths:
+				step['path'] = [xy(j) for j in path(parents, best)]
+			proof.append(step)
+			result['bombs'] = max(result['bombs'], bombs[best])
+
+		# the first bomb: it must be useful (hitting a target, or opening a
+		# breakable wall) and leave a cell to hide in, without bombing anything
+		board.killed.clear()
+		board.kill(())
+		first, _, _ = search(board, start)
+		free = [j for j, b in enumerate(first) if b == 0]
+		useful = [j for j in free if any(board.breakable[k] for k in board.neigh[j])
+				or any(j in spots for spots in bombSpots.values())]
+		if targets and useful and not any(
+				set(free) - board.blast(j, blast, stopAt) for j in useful):
+			fail("player {} has nowhere to hide from its first bomb".format(p))
+	return result
+
+
+def solveGenerated(task):
+	'Worker: generates a seeded level and solves it'
+	import boomlevelgen
+	level, seed, opts, blast, maxNodes = task
+	boomlevelgen.quiet = True
+	random.seed(seed)
+	levelGen = boomlevelgen.BOOMLevel(level, **opts)
+	grid = levelGen.genGrid()
+	result = solve(grid, boomlevelgen.BOOMLevel.WIDTH, boomlevelgen.BOOMLevel.HEIGHT, blast, maxNodes)
+	result['source'] = 'seed {}'.format(seed)
+	result['level'] = level
+	return result
+
+
+def solvePacked(task):
+	'Worker: solves a level read from a pack'
+	grid, source, level, width, height, blast, maxNodes, withPaths = task
+	result = solve(grid, width, height, blast, maxNodes, withPaths)
+	result['source'] = source
+	result['level'] = level
+	return result
+
+
+if __name__ == '__main__':
+	parser = OptionParser(usage="%prog [opts] [PACK...]")
+	parser.add_option("-g", "--generate", type="int", default=0, metavar="N", help="Generate and solve N levels for each level number")
+	parser.add_option("-s", "--seed", type="int", default=0, help="First seed used by --generate")
+	parser.add_option("-L", "--levels", default="1-80", help="Level numbers to generate, as a range (default: %default)")
+	parser.add_option("-e", "--faithfulEnemies", action="store_true", default=False)
+	parser.add_option("-d", "--difficulty", default='normal', help="Difficulty (easy, normal)")
+	parser.add_option("-B", "--blast", type="int", default=DEFAULT_BLAST, help="Bomb blast radius, in cells (default: %default)")
+	parser.add_option("-m", "--maxNodes", type="int", default=None, help="Max cells expanded per player (default: unbounded)")
+	parser.add_option("-P", "--paths", action="store_true", default=False, help="Include the walked paths in the proofs (packs only)")
+	parser.add_option("--json", action="store_true", default=False, help="Print a JSON line per level instead of a report")
+	parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: one per CPU)")
+	options, args = parser.parse_args()
+	if not args and not options.generate:
+		parser.error("nothing to solve: pass some packs or --generate")
+
+	from boomlevelgen import BOOMLevel, LevelPack
+	width, height = BOOMLevel.WIDTH, BOOMLevel.HEIGHT
+	first, _, last = options.levels.partition('-')
+	levelRange = range(int(first), int(last or first) + 1)
+	opts = dict(faithfulEnemies = options.faithfulEnemies, difficulty = options.difficulty)
+
+	failed = unknown = total = 0
+	with Pool(options.jobs) as pool:
+		results = []
+		if options.generate:
+			tasks = [(level, options.seed + n * len(levelRange) + k, opts, options.blast, options.maxNodes)
+					for n in range(options.generate) for k, level in enumerate(levelRange)]
+			results.append(pool.imap(solveGenerated, tasks, chunksize=64))
+		for filename in args:
+			with open(filename) as f:
+				pack = LevelPack(f.read())
+			tasks = [(pack.grid(num), filename, num, width, height, options.blast, options.maxNodes, options.paths)
+					for num in sorted(pack.spans)]
+			results.append(pool.imap(solvePacked, tasks, chunksize=64))
+		for part in results:
+			for r in part:
+				total += 1
+				failed += r['solvable'] is False
+				unknown += r['solvable'] is None
+				if options.json:
+					print(json.dumps(r, separators=(',', ':')))
+				elif r['solvable'] is not True:
+					print("{} level {}: {}".format(r['source'], r['level'],
+						'; '.join(r['reasons'])))
+	if not options.json:
+		print("{} levels: {} solvable, {} unsolvable, {} unknown".format(
+			total, total - failed - unknown, failed, unknown))
+	sys.exit(1 if failed or unknown else 0)
@@ -0,0 +1,40 @@
+import boomlevelgen
+from boomdedup import DedupIndex
+from boomlevelgen import BOOMLevel, levelSeed, randomSeed
+
+
+def grids(n):
+	boomlevelgen.quiet = True
+	levelGen = BOOMLevel(1)
+	out = []
+	for seed in range(n):
+		level = 1 + seed % 79
+		randomSeed(levelSeed(seed, level))
+		levelGen.reset(level)
+		out.append(levelGen.genGrid())
+	return out
+
+
+def checkBuckets(index, cap):
+	stored = dict(index.db.execute('SELECT key, COUNT(*) FROM lsh GROUP BY key').fetchall())
+	for key, size in index.db.execute('SELECT key, size FROM buckets').fetchall():
+		# full buckets are dropped, the others hold all their levels
+		assert stored.get(key, 0) == (0 if size > cap else size)
+
+
+def test_bucket_cap(tmp_path, monkeypatch):
+	monkeypatch.setattr(DedupIndex, 'BUCKET_CAP', 1)
+	levels = grids(300)
+	with DedupIndex(str(tmp_path / 'index.db')) as index:
+		for grid in levels:
+			index.add(grid)
+		checkBuckets(index, 1)
+		assert index.db.execute('SELECT COUNT(*) FROM buckets WHERE size > 1').fetchone()[0] > 0
+		# exact duplicates are still found through the hash, up to symmetry
+		for grid in levels[:20]:
+			assert index.lookup(index.variants(grid)[3]) == (index.lookup(grid)[0], 0, True)
+
+	# a different cap rebuilds the buckets
+	monkeypatch.setattr(DedupIndex, 'BUCKET_CAP', 2)
+	with DedupIndex(str(tmp_path / 'index.db')) as index:
+		checkBuckets(index, 2)
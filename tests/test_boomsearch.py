@@ -0,0 +1,42 @@
+import boomlevelgen
+from boomlevelgen import BOOMLevel, SYM_CENTRAL, levelSeed, randomSeed
+from boomsearch import Query, searchSeeds
+
+SEEDS = range(300)
+
+
+def fullMatches(level, query, **opts):
+	'The seeds matching `query`, found by generating every level in full'
+	boomlevelgen.quiet = True
+	out = []
+	for seed in SEEDS:
+		randomSeed(levelSeed(seed, level))
+		levelGen = BOOMLevel(level, **opts)
+		levelGen.genGrid()
+		if query.match(levelGen) is not None:
+			out.append(seed)
+	return out
+
+
+def earlyMatches(level, query, **opts):
+	_, _, matches, _ = searchSeeds((level, SEEDS, query, 'grid', opts))
+	return [m['seed'] for m in matches]
+
+
+def test_early_rejection_matches_full_generation():
+	queries = [
+		Query(teleports = (4, None)),
+		Query(teleports = (0, 0), walls = 'walkers'),
+		Query(symmetry = SYM_CENTRAL, teleports = (2, 6)),
+		Query(walls = 'regular', enemies = (10, None)),
+	]
+	for level in (7, 40):
+		for query in queries:
+			expected = fullMatches(level, query)
+			assert expected
+			assert earlyMatches(level, query) == expected
+
+
+def test_early_rejection_fundamental():
+	query = Query(symmetry = SYM_CENTRAL, teleports = (4, None))
+	assert earlyMatches(23, query, fundamental = True) == fullMatches(23, query, fundamental = True)
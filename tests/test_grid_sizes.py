@@ -0,0 +1,22 @@
+import pytest
+
+import boomlevelgen
+from boomlevelgen import BOOMLevel, ENGINES, levelSeed, randomSeed, tiles
+
+
+@pytest.mark.parametrize('width, height, levels', [
+	(15, 15, range(1, 80)),
+	(13, 21, range(1, 80)),
+	(21, 13, range(1, 80)),
+	(255, 255, (1, 37)),
+])
+@pytest.mark.parametrize('engine', ['grid', 'bitboard'])
+def test_grid_sizes(monkeypatch, width, height, levels, engine):
+	boomlevelgen.quiet = True
+	monkeypatch.setattr(BOOMLevel, 'WIDTH', width)
+	monkeypatch.setattr(BOOMLevel, 'HEIGHT', height)
+	for level in levels:
+		randomSeed(levelSeed(0, level))
+		grid = ENGINES[engine](level).genGrid()
+		assert len(grid) == width * height
+		assert grid.count(tiles['player1']) == grid.count(tiles['player2']) == 1
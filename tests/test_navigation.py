@@ -0,0 +1,64 @@
+import boomlevelgen
+from boomlevelgen import BOOMLevel, levelSeed, randomSeed, tiles
+
+WIDTH, HEIGHT = BOOMLevel.WIDTH, BOOMLevel.HEIGHT
+
+
+def walkable(nav):
+	bits = bin(int(nav['walkable'], 16))[2:].zfill(len(nav['walkable']) * 4)
+	return [b == '1' for b in bits[:WIDTH * HEIGHT]]
+
+
+def levelWithGrid(rows):
+	level = BOOMLevel(10)
+	level.gridString = ''.join(rows)
+	return level
+
+
+def test_boss_footprint_is_blocked():
+	# a boss at (6, 5) in an open level: its 3x3 footprint must be avoided
+	rows = [tiles['blank'] * WIDTH for _ in range(HEIGHT)]
+	rows[6] = tiles['player1'] + rows[6][1:-1] + tiles['player2']
+	rows[5] = rows[5][:6] + tiles['boss'] + rows[5][7:]
+	nav = levelWithGrid(rows).navigation()
+
+	footprint = set(BOOMLevel.bossFootprint(6, 5))
+	cells = walkable(nav)
+	for y in range(HEIGHT):
+		for x in range(WIDTH):
+			assert cells[y * WIDTH + x] == ((x, y) not in footprint)
+	dist = nav['distances']['player1']
+	for x, y in footprint:
+		assert dist[y * WIDTH + x] == -1
+	# the straight way along row 6 goes through the boss: go around it
+	assert dist[6 * WIDTH + WIDTH - 1] == WIDTH - 1 + 2 * 2
+
+
+def test_generated_boss_levels():
+	boomlevelgen.quiet = True
+	for seed in range(20):
+		randomSeed(levelSeed(seed, 30))
+		level = BOOMLevel(30)
+		level.genGrid()
+		nav = level.navigation()
+		cells = walkable(nav)
+		bosses = [(i % WIDTH, i // WIDTH) for i, c in enumerate(level.gridString) if c == tiles['boss']]
+		assert bosses
+		for bx, by in bosses:
+			for x, y in BOOMLevel.bossFootprint(bx, by):
+				assert not cells[y * WIDTH + x]
+				assert all(d[y * WIDTH + x] == -1 for d in nav['distances'].values())
+
+
+def test_boss_stages_keep_boss_count():
+	boomlevelgen.quiet = True
+	for level in range(10, 80, 10):
+		for seed in range(10):
+			randomSeed(levelSeed(seed, level))
+			lvl = BOOMLevel(level, bossStages = True)
+			lvl.genGrid()
+			bosses = [(i % WIDTH, i // WIDTH) for i, c in enumerate(lvl.gridString) if c == tiles['boss']]
+			assert sorted(bosses) == sorted(lvl.posBosses)
+			assert len(bosses) >= level // 10
+			footprints = [c for bx, by in bosses for c in BOOMLevel.bossFootprint(bx, by)]
+			assert len(footprints) == len(set(footprints))